@@ -0,0 +1,403 @@
+import random
+import numpy as np
+import dominoclasses
+import trainsolver
+import mtrain
+
+def mix64(values):
+    """
+    Returns the splitmix64 mix of a uint64 array, an evenly spread hash of each value
+    """
+    with np.errstate(over="ignore"):
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+class ArrayGames:
+    """
+    Plays many games of mexican train side by side for Random and Greedy players, keeping
+    the state of every game in NumPy arrays instead of Python objects.
+
+    Every game plays the same round at the same time, and each step of a round gives every
+    game that is still going one turn. Legal moves are worked out for all the games at once
+    as boolean masks over (target, domino), and the Greedy and Random choices are made on
+    those masks. Opening trains are the one part still solved a game at a time, through the
+    shared trainsolver.train_cache, which is what the players in playerclasses use as well.
+
+    The state of a round is held as:
+    - arrival: (games, players, dominos), the order each domino came into the hand, or -1
+    - deck: (games, dominos), the shuffled deck of each game, and cursor, its next domino
+    - train_end, train_length and marker: (games, trains), the open pip, the number of
+      dominos and the marker of every train
+    - double_up, doom and current: (games,), the train waiting on a cover (-1 for none),
+      the doom counter and the player whose turn it is
+
+    Each game deals its decks from random.Random(seed), which shuffles the same way as the
+    decks of mtrain.mexicantrain with the same seed, so a game of Greedy players plays out
+    exactly as it does there. Random players make their choices from a splitmix64 stream kept
+    for each game, seeded from its seed and choice_seed, so a game plays out the same whichever
+    games it is played alongside. They match the reference engine in distribution rather
+    than game by game.
+    """
+
+    def __init__(self, num_players, domino_size, modes, seeds, choice_seed=None):
+        if not num_players in range(2, 9):
+            raise ValueError("Number of players must be between 2 and 8, inclusive")
+        if not len(modes) == num_players:
+            raise ValueError("len(modes) must equal num_players")
+        for mode in modes:
+            if not mode in ["Random", "Greedy"]:
+                raise ValueError("ArrayGames only plays Random and Greedy players, not " + str(mode))
+        self.num_players = num_players
+        self.num_trains = num_players + 1
+        self.domino_size = domino_size
+        self.modes = list(modes)
+        self.num_games = len(seeds)
+        self.hand_size = mtrain.hand_sizes[num_players - 2]
+        self.deal_rngs = [random.Random(seed) for seed in seeds]
+        self.choice_state = mix64(np.array(seeds, dtype=np.uint64) ^
+                                  mix64(np.array([choice_seed or 0], dtype=np.uint64)))
+        self.greedy = np.array([mode == "Greedy" for mode in modes])
+
+        #Lookups over the DominoTable index
+        self.table = dominoclasses.domino_table(domino_size)
+        self.count = self.table.count
+        self.first = np.array([domino[0] for domino in self.table.dominos])
+        self.second = np.array([domino[1] for domino in self.table.dominos])
+        self.pips = self.first + self.second
+        #For every pip, its double and the domino_size non-doubles with that pip on one end
+        self.singles_of = np.array([[location for location in range(0, self.count)
+                                     if value in self.table.dominos[location]
+                                     and self.first[location] != self.second[location]]
+                                    for value in range(0, domino_size + 1)])
+        self.double_of = np.array([self.table.index[(value, value)] for value in range(0, domino_size + 1)])
+
+        self.scores = np.zeros((self.num_games, num_players), dtype=np.int64)
+        self.games = np.arange(self.num_games)
+
+    def deal(self, round_number):
+        """
+        Shuffles a new deck for every game, deals the hands and finds the player holding the
+        round's double, drawing a domino for everyone until someone has it
+        """
+        self.deck = np.zeros((self.num_games, self.count), dtype=np.int64)
+        for game in range(0, self.num_games):
+            order = list(range(0, self.count))
+            self.deal_rngs[game].shuffle(order)
+            self.deck[game] = order
+        self.cursor = np.zeros(self.num_games, dtype=np.int64)
+        self.next_arrival = np.zeros(self.num_games, dtype=np.int64)
+        self.arrival = np.full((self.num_games, self.num_players, self.count), -1, dtype=np.int64)
+        for playernum in range(0, self.num_players):
+            for dealt in range(0, self.hand_size):
+                self.draw(self.games, np.full(self.num_games, playernum))
+
+        self.train_end = np.full((self.num_games, self.num_trains), round_number, dtype=np.int64)
+        self.train_length = np.zeros((self.num_games, self.num_trains), dtype=np.int64)
+        self.marker = np.zeros((self.num_games, self.num_trains), dtype=bool)
+        self.marker[:, self.num_players] = True
+        self.double_up = np.full(self.num_games, -1, dtype=np.int64)
+        self.doom = np.zeros(self.num_games, dtype=np.int64)
+        self.playing = np.ones(self.num_games, dtype=bool)
+
+        #The first player in order holding the double starts, otherwise everyone draws one
+        double = self.double_of[round_number]
+        self.current = np.full(self.num_games, -1, dtype=np.int64)
+        waiting = self.games
+        while len(waiting) > 0:
+            holding = self.arrival[waiting, :, double] >= 0
+            found = holding.any(axis=1)
+            self.current[waiting[found]] = np.argmax(holding[found], axis=1)
+            waiting = waiting[~found]
+            for playernum in range(0, self.num_players):
+                self.draw(waiting, np.full(len(waiting), playernum))
+        self.arrival[self.games, self.current, double] = -1
+
+    def draw(self, games, players):
+        """
+        Draws the next domino of each game's deck into the given player's hand, if any are left
+        """
+        left = self.cursor[games] < self.count
+        games = games[left]
+        players = players[left]
+        dominos = self.deck[games, self.cursor[games]]
+        self.arrival[games, players, dominos] = self.next_arrival[games]
+        self.next_arrival[games] += 1
+        self.cursor[games] += 1
+
+    def pick_uniform(self, games, candidates):
+        """
+        Returns the column of a uniformly chosen True in each row of candidates, or -1,
+        drawing each row's choice from the stream of its game
+        """
+        counts = candidates.sum(axis=1)
+        with np.errstate(over="ignore"):
+            self.choice_state[games] += np.uint64(0x9E3779B97F4A7C15)
+        uniform = (mix64(self.choice_state[games]) >> np.uint64(11)) * 2.0**-53
+        picks = (uniform * counts).astype(np.int64)
+        chosen = np.argmax(np.cumsum(candidates, axis=1) > picks[:, np.newaxis], axis=1)
+        chosen[counts == 0] = -1
+        return chosen
+
+    def pick_best(self, keys, candidates):
+        """
+        Returns the column of the largest key among the candidates in each row, or -1
+        """
+        chosen = np.argmax(np.where(candidates, keys, -1), axis=1)
+        chosen[~candidates.any(axis=1)] = -1
+        return chosen
+
+    def pick_cover(self, games, players, pips):
+        """
+        Returns the domino each player covers a double of the given pip with, or -1: Greedy
+        players take the highest scoring domino, first in hand order on ties
+        """
+        options = self.singles_of[pips]
+        arrival = self.arrival[games[:, np.newaxis], players[:, np.newaxis], options]
+        candidates = arrival >= 0
+        keys = self.pips[options] * (self.count + 1) + (self.count - arrival)
+        chosen = np.where(self.greedy[players], self.pick_best(keys, candidates),
+                          self.pick_uniform(games, candidates))
+        return np.where(chosen < 0, -1, options[np.arange(len(games)), chosen])
+
+    def place(self, games, t_nums, dominos, open_pips):
+        """
+        Puts one domino from each game onto a train, leaving open_pips as the open end
+        """
+        self.train_end[games, t_nums] = open_pips
+        self.train_length[games, t_nums] += 1
+
+    def play_forced_doubles(self, games):
+        """
+        Turns of players who must cover the double waiting on train double_up
+        """
+        if len(games) == 0:
+            return
+        players = self.current[games]
+        t_nums = self.double_up[games]
+        pips = self.train_end[games, t_nums]
+        covers = self.pick_cover(games, players, pips)
+        stuck = covers < 0
+        if stuck.any():
+            self.draw(games[stuck], players[stuck])
+            covers[stuck] = self.pick_cover(games[stuck], players[stuck], pips[stuck])
+        stuck = covers < 0
+        self.marker[games[stuck], players[stuck]] = True
+        self.doom[games[stuck]] += 1
+
+        played = ~stuck
+        games, players, t_nums, pips, covers = games[played], players[played], t_nums[played], pips[played], covers[played]
+        self.place(games, t_nums, covers, self.pips[covers] - pips)
+        self.arrival[games, players, covers] = -1
+        self.double_up[games] = -1
+        self.doom[games] = 0
+
+    def play_trains(self, games, round_number):
+        """
+        Turns of players who haven't started their train, solved one game at a time
+        """
+        for game in games:
+            player = self.current[game]
+            train = self.solve_train(game, player, round_number)
+            if len(train) == 0:
+                self.draw(np.array([game]), np.array([player]))
+                train = self.solve_train(game, player, round_number)
+                if len(train) == 0:
+                    self.marker[game, player] = True
+                    self.doom[game] += 1
+                    continue
+            self.doom[game] = 0
+            for domino in train:
+                self.arrival[game, player, self.table.index[domino]] = -1
+            self.train_length[game, player] += len(train)
+            self.train_end[game, player] = train[-1][1]
+            if train[-1][0] == train[-1][1]:
+                self.draw(np.array([game]), np.array([player]))
+
+    def solve_train(self, game, player, round_number):
+        arrival = self.arrival[game, player]
+        held = np.flatnonzero(arrival >= 0)
+        dominos = [self.table.dominos[location] for location in held[np.argsort(arrival[held])]]
+        return trainsolver.train_cache.longest_train(dominos, round_number)
+
+    def choose_plays(self, games):
+        """
+        Finds every legal play of the current players as masks over (target, option), where
+        the options of a target are the non-doubles sharing its pip, and picks one per game
+        the way the player's mode does.
+
+        The targets are every train with a marker (an empty one asks for the round's pip),
+        followed by the player's own train, the same list the players in playerclasses
+        build. A play is a single non-double (kind 0), a double and a domino to cover it
+        (kind 1), or a lone double (kind 2).
+        Returns the kind, target and domino of each chosen play (kind -1 for no play)
+        """
+        rows = np.arange(len(games))
+        players = self.current[games]
+        arrival = self.arrival[games, players]
+        targets = np.concatenate([self.train_end[games], self.train_end[games, players][:, np.newaxis]], axis=1)
+        valid = np.concatenate([self.marker[games], np.ones((len(games), 1), dtype=bool)], axis=1)
+        num_targets = self.num_trains + 1
+
+        options = self.singles_of[targets]
+        option_arrival = arrival[rows[:, np.newaxis, np.newaxis], options]
+        singles = (valid[:, :, np.newaxis] & (option_arrival >= 0)).reshape(len(games), -1)
+        lone_doubles = valid & (arrival[rows[:, np.newaxis], self.double_of[targets]] >= 0)
+        double_pairs = (lone_doubles[:, :, np.newaxis] & singles.reshape(option_arrival.shape)).reshape(len(games), -1)
+        options = options.reshape(len(games), -1)
+
+        kinds = np.full(len(games), -1)
+        choice = np.full(len(games), -1)
+        greedy = self.greedy[players]
+        if greedy.any():
+            #Greedy takes the highest scoring play, ties going to the one found first: singles,
+            #then double pairs, then lone doubles, each by target and then by hand order
+            span = num_targets * self.count
+            ranks = (np.arange(num_targets) * self.count)[np.newaxis, :, np.newaxis] + option_arrival
+            single_keys = self.pips[options] * span + (span - 1 - ranks.reshape(len(games), -1))
+            pair_keys = single_keys + np.repeat(2 * targets * span, options.shape[1] // num_targets, axis=1)
+            double_keys = 2 * targets * span + (span - 1 - np.arange(num_targets))
+            best = np.stack([self.pick_best(single_keys, singles), self.pick_best(pair_keys, double_pairs),
+                             self.pick_best(double_keys, lone_doubles)], axis=1)
+            best_keys = np.stack([single_keys[rows, best[:, 0]], pair_keys[rows, best[:, 1]],
+                                  double_keys[rows, best[:, 2]]], axis=1)
+            best_scores = np.where(best >= 0, best_keys // span, -1)
+            greedy_kinds = np.argmax(best_scores, axis=1)
+            greedy_kinds[best_scores.max(axis=1) < 0] = -1
+            kinds[greedy] = greedy_kinds[greedy]
+            choice[greedy] = best[rows, greedy_kinds][greedy]
+        if not greedy.all():
+            #Random plays a lone double if it can, otherwise any single, never a double pair
+            #Only the Random players draw, so a game's stream doesn't depend on the others
+            double_choice = self.pick_uniform(games[~greedy], lone_doubles[~greedy])
+            single_choice = self.pick_uniform(games[~greedy], singles[~greedy])
+            kinds[~greedy] = np.where(double_choice >= 0, 2, np.where(single_choice >= 0, 0, -1))
+            choice[~greedy] = np.where(double_choice >= 0, double_choice, single_choice)
+
+        target_nums = np.where(kinds == 2, choice, choice // self.domino_size)
+        dominos = np.where(kinds == 2, -1, options[rows, np.maximum(choice, 0)])
+        return kinds, target_nums, dominos
+
+    def play_normally(self, games):
+        """
+        Turns of players with their train started and no double to cover
+        """
+        if len(games) == 0:
+            return
+        kinds, target_nums, dominos = self.choose_plays(games)
+        stuck = kinds < 0
+        if stuck.any():
+            self.draw(games[stuck], self.current[games[stuck]])
+            kinds[stuck], target_nums[stuck], dominos[stuck] = self.choose_plays(games[stuck])
+        stuck = kinds < 0
+        self.marker[games[stuck], self.current[games[stuck]]] = True
+        self.doom[games[stuck]] += 1
+
+        played = ~stuck
+        games, kinds, target_nums, dominos = games[played], kinds[played], target_nums[played], dominos[played]
+        players = self.current[games]
+        self.doom[games] = 0
+
+        #Targets map to their train, except that a play on an empty train goes on the last
+        #empty train with a marker, as the players in playerclasses decide
+        t_nums = np.where(target_nums == self.num_trains, players, target_nums)
+        empty_markers = self.marker[games] & (self.train_length[games] == 0)
+        last_empty = self.num_trains - 1 - np.argmax(empty_markers[:, ::-1], axis=1)
+        t_nums = np.where(self.train_length[games, t_nums] == 0, last_empty, t_nums)
+        pips = self.train_end[games, t_nums]
+
+        #Doubles first, for double pairs and lone doubles
+        doubled = kinds > 0
+        doubles = self.double_of[pips[doubled]]
+        self.place(games[doubled], t_nums[doubled], doubles, pips[doubled])
+        self.arrival[games[doubled], players[doubled], doubles] = -1
+
+        #Singles and the second domino of double pairs
+        single = kinds < 2
+        self.place(games[single], t_nums[single], dominos[single], self.pips[dominos[single]] - pips[single])
+        self.arrival[games[single], players[single], dominos[single]] = -1
+
+        #A lone double is covered by drawing one and trying again, or it waits on the next players
+        lone = kinds == 2
+        games, players, t_nums, pips = games[lone], players[lone], t_nums[lone], pips[lone]
+        self.draw(games, players)
+        covers = self.pick_cover(games, players, pips)
+        stuck = covers < 0
+        self.double_up[games[stuck]] = t_nums[stuck]
+        self.marker[games[stuck], players[stuck]] = True
+        played = ~stuck
+        games, players, t_nums, pips, covers = games[played], players[played], t_nums[played], pips[played], covers[played]
+        self.place(games, t_nums, covers, self.pips[covers] - pips)
+        self.arrival[games, players, covers] = -1
+
+    def play_round(self, round_number):
+        """
+        Plays a round in every game, adding the round's hand scores to scores
+        Returns the number of steps the round took
+        """
+        self.deal(round_number)
+        steps = 0
+        while self.playing.any():
+            games = self.games[self.playing]
+            forced = self.double_up[games] >= 0
+            opening = ~forced & (self.train_length[games, self.current[games]] == 0)
+            normal = ~forced & ~opening
+            self.play_forced_doubles(games[forced])
+            self.play_trains(games[opening], round_number)
+            self.play_normally(games[normal])
+
+            #The round ends when the player runs out of dominos or the doom counter runs over
+            players = self.current[games]
+            out = ~(self.arrival[games, players] >= 0).any(axis=1)
+            self.playing[games[out | (self.doom[games] > self.num_players * 5)]] = False
+            self.current[games] = (players + 1) % self.num_players
+            steps += 1
+        self.scores += np.dot((self.arrival >= 0).astype(np.int64), self.pips)
+        return steps
+
+    def play(self):
+        """
+        Plays every round of every game
+        Returns the scores of every game as a (games, players) array and the index of the
+        winning player of each game
+        """
+        for round_number in range(self.domino_size, -1, -1):
+            self.play_round(round_number)
+        return self.scores, np.argmin(self.scores, axis=1)
+
+def play_array_games(seeds, num_players=4, domino_size=12, modes=["Random", "Greedy", "Random", "Greedy"],
+                     choice_seed=None):
+    """
+    Plays one game per seed with an ArrayGames engine
+    Returns the scores of every game as a (games, players) array and the index of the winner of each
+    """
+    return ArrayGames(num_players, domino_size, modes, seeds, choice_seed).play()
+
+def compare_engines(num_games=200, num_players=4, domino_size=12,
+                    modes=["Greedy", "Greedy", "Greedy", "Greedy"], seed=0):
+    """
+    Plays the same seeded games on mtrain.mexicantrain and on ArrayGames.
+    With only Greedy players every game should come out the same, and identical_games counts
+    the games that did. With Random players only the averages can be compared.
+    Returns a dict of the average scores and win percentages from each engine
+    """
+    rng = random.Random(seed)
+    seeds = [rng.randrange(2**32) for game_num in range(0, num_games)]
+
+    reference_scores = np.zeros((num_games, num_players), dtype=np.int64)
+    reference_winners = np.zeros(num_games, dtype=np.int64)
+    for game_num in range(0, num_games):
+        scores, winner, data = mtrain.mexicantrain(num_players, domino_size, debug=False, modes=modes,
+                                                   seed=seeds[game_num])
+        reference_scores[game_num] = scores
+        reference_winners[game_num] = winner
+
+    array_scores, array_winners = play_array_games(seeds, num_players, domino_size, modes, choice_seed=seed)
+    identical = np.all(reference_scores == array_scores, axis=1) & (reference_winners == array_winners)
+
+    players = np.arange(num_players)[:, np.newaxis]
+    return {"reference_score_averages": reference_scores.mean(axis=0).tolist(),
+            "array_score_averages": array_scores.mean(axis=0).tolist(),
+            "reference_win_percentage": (reference_winners == players).mean(axis=1).tolist(),
+            "array_win_percentage": (array_winners == players).mean(axis=1).tolist(),
+            "identical_games": int(identical.sum())}
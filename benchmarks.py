@@ -0,0 +1,312 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import platform
+import tracemalloc
+import warnings
+import numpy as np
+import mtrain
+import arrayengine
+import playerclasses
+import datasetclasses
+import neuraltrainer
+import trainsolver
+
+#Whether a bigger value of a metric is better, used when comparing against a baseline
+higher_is_better = {"games_per_second": True, "rows_per_second": True, "rollouts_per_second": True, "seconds": False,
+                    "mean_us": False, "p95_us": False, "peak_memory_bytes": False}
+
+def peak_memory(function):
+    """
+    Runs function with tracemalloc on and returns the peak bytes allocated while it ran.
+    NumPy reports its array allocations to tracemalloc, so arrays are counted as well
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def measure(function):
+    """
+    Times one run of function and measures its peak memory on a second run, starting each
+    run with an empty train cache so the runs see the same work.
+    Returns the result of the timed run, its seconds, and the peak memory in bytes
+    """
+    trainsolver.train_cache.clear()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    trainsolver.train_cache.clear()
+    return result, seconds, peak_memory(function)
+
+class DecisionTimer:
+    """
+    Times every call of the decision methods of the given player classes while active.
+
+    Used as a context manager: on entry each method is wrapped to record how long each call
+    took in times, keyed on (class name, method name), and on exit the classes are put back
+    """
+
+    def __init__(self, classes, methods=["play_train", "play_normally", "play_forced_double"]):
+        self.classes = classes
+        self.methods = methods
+        self.times = {}
+        self.originals = []
+
+    def wrap(self, cls, name, original):
+        times = self.times.setdefault((cls.__name__, name), [])
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            result = original(*args, **kwargs)
+            times.append(time.perf_counter() - start)
+            return result
+        return timed
+
+    def __enter__(self):
+        for cls in self.classes:
+            for name in self.methods:
+                self.originals.append((cls, name, cls.__dict__[name]))
+                setattr(cls, name, self.wrap(cls, name, cls.__dict__[name]))
+        return self
+
+    def __exit__(self, *exc):
+        for cls, name, original in self.originals:
+            setattr(cls, name, original)
+        self.originals = []
+
+def play_games(num_games, num_players, domino_size, modes, seed, file_name="", data_collection=False):
+    """
+    Plays num_games seeded games of mexicantrain
+    Returns the list of each game's results
+    """
+    results = []
+    for game_num in range(0, num_games):
+        results.append(mtrain.mexicantrain(num_players, domino_size, data_collection=data_collection,
+                                           debug=False, modes=modes, file_name=file_name,
+                                           data_format="arrays", seed=seed + game_num))
+    return results
+
+def bench_engine(num_games, num_players, domino_size, modes, seed, file_name=""):
+    """
+    Returns the games per second of mexicantrain with the given seats, and its peak memory
+    """
+    results, seconds, memory = measure(lambda: play_games(num_games, num_players, domino_size,
+                                                          modes, seed, file_name))
+    return {"games": num_games, "seconds": seconds, "games_per_second": num_games / seconds,
+            "peak_memory_bytes": memory}
+
+def bench_array_engine(num_games, num_players, domino_size, modes, seed):
+    """
+    Returns the games per second of arrayengine.ArrayGames with the given seats, and its peak memory
+    """
+    seeds = [seed + game_num for game_num in range(0, num_games)]
+    results, seconds, memory = measure(lambda: arrayengine.play_array_games(seeds, num_players, domino_size,
+                                                                            modes, choice_seed=seed))
+    return {"games": num_games, "seconds": seconds, "games_per_second": num_games / seconds,
+            "peak_memory_bytes": memory}
+
+def bench_decisions(num_games, num_players, domino_size, modes, seed, file_name=""):
+    """
+    Returns the latency of every decision method of the players in modes, measured on
+    every call they get during num_games games
+    """
+    classes = [playerclasses.RandomPlayer, playerclasses.GreedyPlayer,
+               playerclasses.ProbabilityPlayer, playerclasses.NeuralPlayer]
+    trainsolver.train_cache.clear()
+    with DecisionTimer(classes) as timer:
+        play_games(num_games, num_players, domino_size, modes, seed, file_name)
+    trainsolver.train_cache.clear()
+    with DecisionTimer(classes):
+        memory = peak_memory(lambda: play_games(num_games, num_players, domino_size, modes, seed, file_name))
+
+    results = {}
+    for (class_name, method), times in sorted(timer.times.items()):
+        if len(times) == 0:
+            continue
+        times = np.array(times) * 1e6
+        results["decision/" + class_name + "/" + method] = {
+            "calls": len(times), "mean_us": float(np.mean(times)),
+            "p95_us": float(np.percentile(times, 95)), "peak_memory_bytes": memory}
+    return results
+
+def bench_data_collection(num_games, num_players, domino_size, seed, directory):
+    """
+    Returns the rows per second collected by mexicantrain in data_collection mode, and writes
+    the rows to a dataset in directory for the neuraltrainer benchmarks
+    """
+    modes = ["Random", "Greedy", "Probability"] * num_players
+    modes = modes[0:num_players]
+    results, seconds, memory = measure(lambda: play_games(num_games, num_players, domino_size, modes,
+                                                          seed, data_collection=True))
+    writer = datasetclasses.ShardWriter(directory, num_players, domino_size)
+    for game in results:
+        writer.add(game[2])
+    writer.close()
+    return {"games": num_games, "rows": writer.rows, "seconds": seconds,
+            "rows_per_second": writer.rows / seconds, "peak_memory_bytes": memory}
+
+def bench_featurize(directory):
+    """
+    Returns the time taken to build the feature matrix of a dataset from its shards
+    """
+    def featurize():
+        for name in ["features.npy", "points.npy", "features.json"]:
+            if os.path.isfile(os.path.join(directory, name)):
+                os.remove(os.path.join(directory, name))
+        datasetclasses.build_feature_matrix(directory)
+    results, seconds, memory = measure(featurize)
+    rows = datasetclasses.read_manifest(directory)["rows"]
+    return {"rows": rows, "seconds": seconds, "rows_per_second": rows / seconds,
+            "peak_memory_bytes": memory}
+
+def bench_rollouts(num_games, num_players, domino_size, seed):
+    """
+    Returns how many rollouts a RolloutPlayer runs per decision and how fast, over num_games
+    games with one Rollout seat against Greedy players. Only decisions with more than one
+    play to choose from run rollouts, so only those are counted
+    """
+    modes = ["Rollout"] + ["Greedy"] * (num_players - 1)
+    counts = []
+    times = []
+    original = playerclasses.RolloutPlayer.evaluate_moves
+    def counted(player, state, moves, dominos):
+        start = time.perf_counter()
+        totals = original(player, state, moves, dominos)
+        times.append(time.perf_counter() - start)
+        counts.append(player.rollouts * len(moves))
+        return totals
+    def play():
+        del counts[:], times[:]
+        playerclasses.RolloutPlayer.evaluate_moves = counted
+        try:
+            play_games(num_games, num_players, domino_size, modes, seed)
+        finally:
+            playerclasses.RolloutPlayer.evaluate_moves = original
+        return list(counts), np.array(times) * 1e6
+    #Keep the timed run's counts and times, the memory run is slowed down by tracemalloc
+    (rollouts, latencies), seconds, memory = measure(play)
+    return {"decisions": len(rollouts), "rollouts_per_decision": float(np.mean(rollouts)),
+            "mean_us": float(latencies.mean()), "p95_us": float(np.percentile(latencies, 95)),
+            "rollouts_per_second": float(sum(rollouts) / (latencies.sum() / 1e6)), "peak_memory_bytes": memory}
+
+def bench_fit(directory, num_players, domino_size, seed, max_iter):
+    """
+    Returns the time neuraltrainer takes to train on a dataset whose features are built,
+    leaving the trained model next to the dataset
+    """
+    def fit():
+        np.random.seed(seed)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return neuraltrainer.train_neural_net(directory, num_players, domino_size, max_iter=max_iter)
+    results, seconds, memory = measure(fit)
+    rows = datasetclasses.read_manifest(directory)["rows"]
+    return {"rows": rows, "max_iter": max_iter, "seconds": seconds, "peak_memory_bytes": memory}
+
+def run_benchmarks(output="Benchmarks/results.json", baseline="Benchmarks/baseline.json",
+                   domino_size=12, num_games=10, array_games=200, player_counts=[2, 4, 6], 
+                   fit_iterations=5, rollout_games=1, seed=0, tolerance=.25, debug=True):
+    """
+    Runs the benchmark suite and saves the results as JSON to output:
+    - engine: games per second of mexicantrain for every player mode and player count, with
+      every seat playing that mode, plus arrayengine for Random and Greedy over array_games
+      games, since it only pays off on large batches
+    - decision: mean and 95th percentile latency of each player's play_train, play_normally
+      and play_forced_double, over every call in 4 player games with one seat of each mode
+    - rollouts: rollouts per decision, decision latency and rollouts per second of a
+      RolloutPlayer over rollout_games 4 player games against Greedy players
+    - data_collection: rows per second of mexicantrain in data_collection mode
+    - neuraltrainer: time to build the feature matrix of the collected dataset, and to train
+      on it for fit_iterations iterations
+    Every benchmark also records its peak memory, measured with tracemalloc on a second run.
+
+    The Neural benchmarks use the model trained by the neuraltrainer benchmark, so no model
+    file is needed. Every game is seeded from seed, so runs do the same work each time.
+
+    If the baseline file exists, the results are compared against it (see compare_results)
+    and any metric more than tolerance worse than the baseline is reported as a regression.
+    Copy a results file to the baseline path to make it the new baseline.
+    Returns the results and the list of regressions
+    """
+    results = {"meta": {"python": platform.python_version(), "numpy": np.__version__,
+                        "platform": platform.platform(), "domino_size": domino_size,
+                        "num_games": num_games, "array_games": array_games, "seed": seed, "time": time.time()},
+               "benchmarks": {}}
+    benchmarks = results["benchmarks"]
+    directory = tempfile.mkdtemp()
+    dataset = os.path.join(directory, "data4_" + str(domino_size))
+    try:
+        if debug: print("Benchmarking data collection and training...")
+        benchmarks["data_collection/4p"] = bench_data_collection(num_games, 4, domino_size, seed, dataset)
+        benchmarks["neuraltrainer/featurize"] = bench_featurize(dataset)
+        benchmarks["neuraltrainer/fit"] = bench_fit(dataset, 4, domino_size, seed, fit_iterations)
+
+        for num_players in player_counts:
+            for mode in ["Random", "Greedy", "Probability"]:
+                if debug: print("Benchmarking " + mode + " games with " + str(num_players) + " players...")
+                benchmarks["engine/" + mode + "/" + str(num_players) + "p"] = bench_engine(
+                    num_games, num_players, domino_size, [mode] * num_players, seed)
+                if mode in ["Random", "Greedy"]:
+                    benchmarks["engine/arrays/" + mode + "/" + str(num_players) + "p"] = bench_array_engine(
+                        array_games, num_players, domino_size, [mode] * num_players, seed)
+        if debug: print("Benchmarking Neural games with 4 players...")
+        benchmarks["engine/Neural/4p"] = bench_engine(num_games, 4, domino_size, ["Neural"] * 4, seed, dataset)
+
+        if debug: print("Benchmarking player decisions...")
+        benchmarks.update(bench_decisions(num_games, 4, domino_size, ["Random", "Greedy", "Probability", "Neural"],
+                                          seed, dataset))
+        if debug: print("Benchmarking rollout decisions...")
+        benchmarks["rollouts/4p"] = bench_rollouts(rollout_games, 4, domino_size, seed)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+        playerclasses.model_registry.invalidate()
+
+    save_results(results, output)
+    regressions = []
+    if baseline is not None and os.path.isfile(baseline):
+        regressions = compare_results(results, load_results(baseline), tolerance)
+        if debug: print_regressions(regressions, baseline)
+    return results, regressions
+
+def save_results(results, path):
+    directory = os.path.dirname(path)
+    if len(directory) > 0:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as results_file:
+        json.dump(results, results_file, indent=1, sort_keys=True)
+
+def load_results(path):
+    with open(path) as results_file:
+        return json.load(results_file)
+
+def compare_results(results, baseline, tolerance=.25):
+    """
+    Compares every metric of every benchmark found in both results and baseline.
+    Returns a list of (benchmark, metric, baseline value, current value, relative change) for
+    each metric that got more than tolerance worse, where the change is positive for worse
+    """
+    regressions = []
+    for name, metrics in sorted(results["benchmarks"].items()):
+        baseline_metrics = baseline["benchmarks"].get(name)
+        if baseline_metrics is None:
+            continue
+        for metric, higher in higher_is_better.items():
+            if not metric in metrics or not metric in baseline_metrics or baseline_metrics[metric] == 0:
+                continue
+            change = (metrics[metric] - baseline_metrics[metric]) / float(baseline_metrics[metric])
+            if higher:
+                change = -change
+            if change > tolerance:
+                regressions.append((name, metric, baseline_metrics[metric], metrics[metric], change))
+    return regressions
+
+def print_regressions(regressions, baseline):
+    if len(regressions) == 0:
+        print("No regressions against " + baseline)
+    for name, metric, old, new, change in regressions:
+        print("Regression in " + name + " " + metric + ": " + str(round(old, 2)) + " -> " +
+              str(round(new, 2)) + " (" + str(round(change * 100, 1)) + "% worse)")
@@ -0,0 +1,267 @@
+import os
+import json
+import numpy as np
+import dominoclasses
+
+#Columns holding one hot blocks, which are bit packed along their last axis in a shard
+packed_columns = ["play", "hand", "unknown", "potential_plays", "trains"]
+scalar_columns = ["round_number", "turn_number", "player_number", "t_num", "points", "markers"]
+
+class ShardWriter:
+    """
+    Writes collected play data to a directory of .npz shards plus a manifest.json.
+
+    Games are added with add as they finish, using the dict of arrays returned by
+    mexicantrain in data_format="arrays" mode. Once rows_per_shard rows are buffered they are
+    written out as a shard, with the one hot blocks bit packed, and the manifest is rewritten
+    so the dataset can be read even while a run is still going. close writes the last shard.
+
+    With append on and a dataset already in directory, its shards are kept and the new ones
+    are numbered on from the last of them, so every old shard keeps its number (and with it
+    the rows holdout_mask holds out). Otherwise the dataset is started over.
+    """
+
+    def __init__(self, directory, num_players, domino_size, rows_per_shard=50000, append=False):
+        self.directory = directory
+        self.num_players = num_players
+        self.domino_size = domino_size
+        self.domino_count = dominoclasses.domino_table(domino_size).count
+        self.rows_per_shard = rows_per_shard
+        self.buffer = []
+        self.buffered_rows = 0
+        self.shards = []
+        self.rows = 0
+        if append and is_dataset(directory):
+            manifest = read_manifest(directory)
+            if manifest["num_players"] != num_players or manifest["domino_size"] != domino_size:
+                raise ValueError("Can't append to " + directory + ", its data is for " +
+                                 str(manifest["num_players"]) + " players and domino size " +
+                                 str(manifest["domino_size"]))
+            self.shards = manifest["shards"]
+            self.rows = manifest["rows"]
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, arrays):
+        rows = arrays["points"].shape[0]
+        if rows == 0:
+            return
+        self.buffer.append(arrays)
+        self.buffered_rows += rows
+        if self.buffered_rows >= self.rows_per_shard:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered games out as a shard and updates the manifest
+        """
+        if self.buffered_rows == 0:
+            return
+        shard = {}
+        for name in scalar_columns:
+            shard[name] = np.concatenate([arrays[name] for arrays in self.buffer])
+        for name in packed_columns:
+            block = np.concatenate([arrays[name] for arrays in self.buffer])
+            shard[name] = np.packbits(block, axis=-1)
+        shard_name = "shard_" + str(len(self.shards)).zfill(5) + ".npz"
+        np.savez(os.path.join(self.directory, shard_name), **shard)
+
+        self.shards.append({"file": shard_name, "rows": self.buffered_rows})
+        self.rows += self.buffered_rows
+        self.buffer = []
+        self.buffered_rows = 0
+        self.write_manifest()
+
+    def write_manifest(self):
+        manifest = {"num_players": self.num_players, "domino_size": self.domino_size,
+                    "domino_count": self.domino_count, "rows": self.rows,
+                    "packed_columns": packed_columns, "scalar_columns": scalar_columns,
+                    "shards": self.shards}
+        with open(os.path.join(self.directory, "manifest.json"), "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=1)
+
+    def close(self):
+        self.flush()
+        self.write_manifest()
+
+def is_dataset(path):
+    """
+    Returns True if path is a directory written by ShardWriter
+    """
+    return os.path.isfile(os.path.join(path, "manifest.json"))
+
+def read_manifest(path):
+    with open(os.path.join(path, "manifest.json")) as manifest_file:
+        return json.load(manifest_file)
+
+def read_shard(path, shard_name, domino_count):
+    """
+    Reads one shard, returning a dict of arrays with the one hot blocks unpacked to uint8
+    """
+    arrays = {}
+    with np.load(os.path.join(path, shard_name)) as shard:
+        for name in scalar_columns:
+            arrays[name] = shard[name]
+        for name in packed_columns:
+            arrays[name] = np.unpackbits(shard[name], axis=-1)[..., 0:domino_count]
+    return arrays
+
+def iter_shards(path):
+    """
+    Yields the unpacked arrays of every shard in a dataset, in the order they were written
+    """
+    manifest = read_manifest(path)
+    for shard in manifest["shards"]:
+        yield read_shard(path, shard["file"], manifest["domino_count"])
+
+def load_dataset(path):
+    """
+    Reads every shard in a dataset and returns one dict of arrays holding all the rows
+    """
+    shards = list(iter_shards(path))
+    arrays = {}
+    for name in scalar_columns + packed_columns:
+        arrays[name] = np.concatenate([shard[name] for shard in shards])
+    return arrays
+
+def feature_names(num_players, domino_size):
+    """
+    Returns the names of the neural net features, in the order feature_matrix lays them out
+    """
+    count = dominoclasses.domino_table(domino_size).count
+    names = ["round_number", "turn_number", "t_num"]
+    for current in range(0, count):
+        for col in ["play", "hand", "unknown", "potential_plays"]:
+            names.append(col + "_" + str(current))
+    for num in range(0, num_players + 1):
+        names.append("marker_" + str(num))
+        for current in range(0, count):
+            names.append("train_" + str(num) + "_" + str(current))
+    return names
+
+def feature_matrix(arrays, dtype=np.float32):
+    """
+    Turns a dict of arrays into the neural net feature matrix, laid out in the same column
+    order neuraltrainer and NeuralPlayer have always used (see feature_names).
+    Returns the feature matrix and the points column
+    """
+    rows = arrays["points"].shape[0]
+    vectors = np.stack([arrays["play"], arrays["hand"], arrays["unknown"], arrays["potential_plays"]], axis=2)
+    trains = np.concatenate([arrays["markers"][:, :, np.newaxis], arrays["trains"]], axis=2)
+    features = np.concatenate([arrays["round_number"][:, np.newaxis].astype(dtype),
+                               arrays["turn_number"][:, np.newaxis].astype(dtype),
+                               arrays["t_num"][:, np.newaxis].astype(dtype),
+                               vectors.reshape(rows, -1).astype(dtype),
+                               trains.reshape(rows, -1).astype(dtype)], axis=1)
+    return features, arrays["points"].astype(dtype)
+
+def build_feature_matrix(path, dtype=np.float32):
+    """
+    Writes the neural net feature matrix of a dataset to features.npy and points.npy inside
+    the dataset directory, one shard at a time, so the full matrix never has to fit in memory.
+    Next to them features.json records the shards they were built from, with the size and
+    modification time of every shard file, and the files are rebuilt whenever the dataset no
+    longer matches it.
+    Returns the paths of the two files
+    """
+    manifest = read_manifest(path)
+    features_path = os.path.join(path, "features.npy")
+    points_path = os.path.join(path, "points.npy")
+    key_path = os.path.join(path, "features.json")
+    key = {"dtype": np.dtype(dtype).str, "shards": []}
+    for shard in manifest["shards"]:
+        status = os.stat(os.path.join(path, shard["file"]))
+        key["shards"].append({"file": shard["file"], "rows": shard["rows"], "size": status.st_size,
+                              "mtime_ns": status.st_mtime_ns})
+    if os.path.isfile(features_path) and os.path.isfile(points_path) and os.path.isfile(key_path):
+        with open(key_path) as key_file:
+            if json.load(key_file) == key:
+                return features_path, points_path
+        #Drop the key before rebuilding so a half written matrix is never taken as current
+        os.remove(key_path)
+
+    count = manifest["domino_count"]
+    columns = 3 + 4 * count + (manifest["num_players"] + 1) * (count + 1)
+    features = np.lib.format.open_memmap(features_path, mode="w+", dtype=dtype, 
+                                         shape=(manifest["rows"], columns))
+    points = np.lib.format.open_memmap(points_path, mode="w+", dtype=dtype, 
+                                       shape=(manifest["rows"],))
+    row = 0
+    for arrays in iter_shards(path):
+        shard_features, shard_points = feature_matrix(arrays, dtype)
+        features[row:row + shard_features.shape[0]] = shard_features
+        points[row:row + shard_features.shape[0]] = shard_points
+        row += shard_features.shape[0]
+    features.flush()
+    points.flush()
+    del features, points
+    with open(key_path, "w") as key_file:
+        json.dump(key, key_file, indent=1)
+    return features_path, points_path
+
+def load_feature_matrix(path):
+    """
+    Returns the feature matrix and points of a dataset as read only memory maps, building
+    them first if needed. Rows are only read from disk when they are indexed.
+    """
+    features_path, points_path = build_feature_matrix(path)
+    return np.load(features_path, mmap_mode="r"), np.load(points_path, mmap_mode="r")
+
+def holdout_mask(shard_number, rows, holdout, seed=0):
+    """
+    Returns a boolean mask of the rows of a shard held out of training. It depends only on the
+    shard's number, its row count and seed, so the same rows are held out every epoch, every
+    run, and once more shards have been added to the dataset
+    """
+    return np.random.RandomState((seed * 100003 + shard_number) % 2**32).random_sample(rows) < holdout
+
+def iter_feature_shards(path, rng=None, holdout=0.0, held_out=False, seed=0, dtype=np.float32):
+    """
+    Yields the features and points of every shard of a dataset, one shard at a time, in a
+    random order drawn from the NumPy RandomState rng if one is given. Only the training rows
+    are yielded, or only the rows held out (see holdout_mask) when held_out is on
+    """
+    manifest = read_manifest(path)
+    shard_order = range(0, len(manifest["shards"]))
+    if rng is not None:
+        shard_order = rng.permutation(len(manifest["shards"]))
+    for shard_number in shard_order:
+        shard = manifest["shards"][shard_number]
+        features, points = feature_matrix(read_shard(path, shard["file"], manifest["domino_count"]), dtype)
+        rows = holdout_mask(shard_number, points.shape[0], holdout, seed)
+        if not held_out:
+            rows = ~rows
+        yield features[rows], points[rows]
+
+def iter_batches(path, batch_rows, buffer_rows, rng, holdout=0.0, seed=0, dtype=np.float32):
+    """
+    Yields shuffled batches of (features, points) of the training rows of a dataset, reading
+    the shards in random order through a shuffle buffer. Rows are gathered into the buffer
+    until it holds buffer_rows rows (or a shard, if that is more), then the buffer is shuffled
+    and batches are taken from it until half of it is left, to be mixed with the next shard.
+    At most the buffer and one shard are in memory at once
+    """
+    features = None
+    points = None
+    for shard_features, shard_points in iter_feature_shards(path, rng, holdout, False, seed, dtype):
+        if features is None:
+            features = shard_features
+            points = shard_points
+        else:
+            features = np.concatenate([features, shard_features])
+            points = np.concatenate([points, shard_points])
+        if features.shape[0] < buffer_rows:
+            continue
+        order = rng.permutation(features.shape[0])
+        features = features[order]
+        points = points[order]
+        taken = ((features.shape[0] - buffer_rows // 2) // batch_rows) * batch_rows
+        for start in range(0, taken, batch_rows):
+            yield features[start:start + batch_rows], points[start:start + batch_rows]
+        features = features[taken:]
+        points = points[taken:]
+
+    if features is not None and features.shape[0] > 0:
+        order = rng.permutation(features.shape[0])
+        for start in range(0, order.shape[0], batch_rows):
+            batch = order[start:start + batch_rows]
+            yield features[batch], points[batch]
@@ -1,31 +1,184 @@
 import random
+import numpy as np
 
-class Deck:
+_domino_tables = {}
+
+def domino_table(domino_size):
+    """
+    Returns the DominoTable for the given domino size, building it the first time it is needed
+    so every hand, train, deck and one hot encoding in the process shares the same lookups
+    """
+    table = _domino_tables.get(domino_size)
+    if table is None:
+        table = DominoTable(domino_size)
+        _domino_tables[domino_size] = table
+    return table
+
+class DominoTable:
+    """
+    Precomputed lookups for a full set of dominos, used by the compact (bitmask) mode and
+    as the one hot encoder for data collection and the neural net.
+    Each domino (x, y) with x <= y gets an index in the order Deck creates them, and that
+    index is both the domino's bit in a bitmask and its position in a one hot array.
+    Both orientations of a domino map to the same index, and dominos holds the reverse lookup.
+    """
 
-    def __init__(self, domino_value):
+    def __init__(self, domino_size):
+        self.domino_size = domino_size
         self.dominos = []
+        self.index = {}
+        self.pips = []
+        self.pip_masks = [0 for x in range(0, domino_size + 1)]
+        self.double_masks = [0 for x in range(0, domino_size + 1)]
+        for x in range(0, domino_size + 1):
+            for y in range(x, domino_size + 1):
+                location = len(self.dominos)
+                self.dominos.append((x, y))
+                self.index[(x, y)] = location
+                self.index[(y, x)] = location
+                self.pips.append(x + y)
+                self.pip_masks[x] |= 1 << location
+                self.pip_masks[y] |= 1 << location
+                if x == y:
+                    self.double_masks[x] = 1 << location
+        self.count = len(self.dominos)
+        self.full_mask = (1 << self.count) - 1
+        self.mask_bytes = (self.count + 7) // 8
+
+    def bit(self, domino):
+        return 1 << self.index[domino]
+
+    def mask_of(self, dominos):
+        """
+        Returns the bitmask of a list of dominos, ignoring the (-1, -1) empty deck marker
+        """
+        mask = 0
+        for domino in dominos:
+            if domino[0] < 0:
+                continue
+            mask |= 1 << self.index[domino]
+        return mask
+
+    def dominos_in(self, mask):
+        """
+        Returns the dominos set in a bitmask in index order, in O(popcount)
+        """
+        dominos = []
+        while mask:
+            low = mask & -mask
+            dominos.append(self.dominos[low.bit_length() - 1])
+            mask ^= low
+        return dominos
+
+    def score_of(self, mask):
+        """
+        Returns the pip sum of the dominos set in a bitmask, in O(popcount)
+        """
+        score = 0
+        while mask:
+            low = mask & -mask
+            score += self.pips[low.bit_length() - 1]
+            mask ^= low
+        return score
+
+    def encode(self, dominos):
+        """
+        Returns a uint8 one hot array with a 1 at the index of each domino in dominos
+        """
+        one_hot = np.zeros(self.count, dtype=np.uint8)
+        locations = [self.index[domino] for domino in dominos if domino[0] >= 0]
+        one_hot[locations] = 1
+        return one_hot
+
+    def encode_many(self, domino_sets):
+        """
+        Returns a 2D uint8 array holding the one hot encoding of each list of dominos as a row
+        """
+        one_hot = np.zeros((len(domino_sets), self.count), dtype=np.uint8)
+        rows = []
+        locations = []
+        for row in range(0, len(domino_sets)):
+            for domino in domino_sets[row]:
+                if domino[0] < 0:
+                    continue
+                rows.append(row)
+                locations.append(self.index[domino])
+        one_hot[rows, locations] = 1
+        return one_hot
+
+    def encode_mask(self, mask):
+        """
+        Returns the uint8 one hot array of a compact mode bitmask
+        """
+        packed = np.frombuffer(mask.to_bytes(self.mask_bytes, "big"), dtype=np.uint8)
+        return np.unpackbits(packed)[::-1][0:self.count]
+
+    def decode(self, one_hot):
+        """
+        Returns the list of dominos set in a one hot array
+        """
+        return [self.dominos[location] for location in np.flatnonzero(one_hot)]
+
+class Deck:
+    """
+    A shuffled deck of every domino up to domino_value.
+
+    The shuffled dominos are kept in order with a cursor pointing at the next one to draw,
+    so drawing k dominos is O(k) and never copies the rest of the deck. deck.dominos is the
+    list of dominos still to be drawn.
+
+    rng is the random number generator the deck shuffles with: a random.Random, or a NumPy
+    RandomState or Generator. Without one the deck shuffles with the random module, as it
+    always has. A random.Random(seed) shuffles exactly as the random module does after
+    random.seed(seed).
+    """
+
+    def __init__(self, domino_value, compact=False, rng=None):
+        self.order = []
         for x in range(0, domino_value + 1):
             for y in range(x, domino_value + 1):
-                self.dominos.append((x, y))
-        
-        random.shuffle(self.dominos)
+                self.order.append((x, y))
+
+        if rng is None:
+            random.shuffle(self.order)
+        elif hasattr(rng, "permutation"):
+            self.order = [self.order[location] for location in rng.permutation(len(self.order))]
+        else:
+            rng.shuffle(self.order)
+        self.cursor = 0
+
+        #In compact mode the dominos left in the deck are also tracked as a bitmask
+        self.table = None
+        self.mask = 0
+        if compact:
+            self.table = domino_table(domino_value)
+            self.mask = self.table.full_mask
+
+    @property
+    def dominos(self):
+        return self.order[self.cursor:]
 
     def draw(self, number):
-        drawnpile = []
-        if len(self.dominos) == 0:
+        if self.cursor == len(self.order):
             return [(-1, -1)]
-        elif len(self.dominos) < number:
-            number = len(self.dominos)
         
-        drawnpile = self.dominos[0:number]
-        self.dominos = self.dominos[number:]
+        drawnpile = self.order[self.cursor:self.cursor + number]
+        self.cursor += len(drawnpile)
+        if self.table is not None:
+            self.mask &= ~self.table.mask_of(drawnpile)
         return drawnpile
 
 class Train:
 
-    def __init__(self):
+    def __init__(self, domino_size=None):
         self.train_list = []
         self.marker_up = False
+
+        #In compact mode the dominos on the train are also tracked as a bitmask
+        self.table = None
+        self.mask = 0
+        if domino_size is not None:
+            self.table = domino_table(domino_size)
     
     def add_train(self, dominos):
         for dom in dominos:
@@ -33,6 +186,8 @@ class Train:
 
     def add_domino(self, domino):
         self.train_list.append(domino)
+        if self.table is not None:
+            self.mask |= self.table.bit(domino)
     
     def set_marker(self, marker):
         self.marker_up = marker
@@ -48,21 +203,114 @@ class Train:
             return (-1, -1)
         return self.train_list[len(self.train_list) - 1]
     
+def pip_index(dominos):
+    """
+    Returns a dict from each pip to the tuple of dominos that have that pip on either end,
+    keeping the order the dominos appear in
+    """
+    by_pip = {}
+    for domino in dominos:
+        by_pip[domino[0]] = by_pip.get(domino[0], ()) + (domino,)
+        if domino[1] != domino[0]:
+            by_pip[domino[1]] = by_pip.get(domino[1], ()) + (domino,)
+    return by_pip
+
+class DominoList(list):
+    """
+    A list of dominos that also carries the pip index (see pip_index) of the hand it came from
+    in by_pip, so move generation can go straight to the dominos matching a pip
+    """
+    by_pip = None
+
 class Hand:
+    """
+    A player's hand of dominos. By default the dominos are kept as a list of tuples.
 
-    def __init__(self, dominos):
-        self.dominos = dominos
+    Every hand also keeps a pip index, by_pip, mapping each pip to the dominos in the hand with
+    that pip. hand.dominos is a DominoList carrying the index, which the players' move
+    generators use. The index is copied on write, so a list handed out earlier keeps a matching
+    index even after the hand changes.
+
+    When a domino_size is given the hand runs in compact mode: the dominos are stored as a
+    bitmask over the DominoTable index, membership, removal and double checks are O(1), and
+    the score is kept up to date as dominos come and go instead of being re-summed.
+    hand.dominos is still a list of tuples in the order the dominos were received, so
+    players see the same hand in either mode.
+    """
+
+    def __init__(self, dominos, domino_size=None):
+        self.table = None
+        self.mask = 0
+        self._order = None
+        self._view = None
+        self._dominos = DominoList()
+        self.by_pip = {}
         self.score = 0
-        for domino in self.dominos:
-            total = domino[0] + domino[1]
-            self.score += total
-    
+        if domino_size is None:
+            self.dominos = dominos
+            self.update_score()
+        else:
+            self.table = domino_table(domino_size)
+            self._order = {}
+            self.add_dominos(dominos)
+
+    @property
+    def dominos(self):
+        if self.table is None:
+            return self._dominos
+        if self._view is None:
+            self._view = DominoList(self._order)
+            self._view.by_pip = self.by_pip
+        return self._view
+
+    @dominos.setter
+    def dominos(self, dominos):
+        if self.table is None:
+            self._dominos = DominoList(dominos)
+            self.by_pip = pip_index(self._dominos)
+            self._dominos.by_pip = self.by_pip
+        else:
+            self.mask = 0
+            self._order = {}
+            self.by_pip = {}
+            self.score = 0
+            self._view = None
+            self.add_dominos(dominos)
+
     def update_score(self):
+        if self.table is not None:
+            self.score = self.table.score_of(self.mask)
+            return
         self.score = 0
         for domino in self.dominos:
             self.score += domino[0] + domino[1]
+
+    def has_domino(self, domino):
+        if self.table is not None:
+            return self.mask & self.table.bit(domino) != 0
+        for dom in self.dominos:
+            if (domino[0] == dom[0] and domino[1] == dom[1]) \
+                    or (domino[1] == dom[0] and domino[0] == dom[1]):
+                return True
+        return False
     
     def remove_domino(self, domino):
+        if self.table is not None:
+            if domino[0] < 0:
+                return
+            location = self.table.index[domino]
+            if self.mask & (1 << location):
+                removed = self.table.dominos[location]
+                self.mask ^= 1 << location
+                self.score -= self.table.pips[location]
+                del self._order[removed]
+                by_pip = dict(self.by_pip)
+                for pip in set(removed):
+                    by_pip[pip] = tuple(dom for dom in by_pip[pip] if dom != removed)
+                self.by_pip = by_pip
+                self._view = None
+            return
+
         new_dominos = []
         for dom in self.dominos:
             if not (domino[0] == dom[0] and domino[1] == dom[1]) \
@@ -73,18 +321,42 @@ class Hand:
         self.update_score()
     
     def add_dominos(self, dominos):
+        if self.table is not None:
+            by_pip = dict(self.by_pip)
+            for domino in dominos:
+                if domino[0] < 0:
+                    continue
+                location = self.table.index[domino]
+                if self.mask & (1 << location):
+                    continue
+                added = self.table.dominos[location]
+                self.mask |= 1 << location
+                self.score += self.table.pips[location]
+                self._order[added] = None
+                for pip in set(added):
+                    by_pip[pip] = by_pip.get(pip, ()) + (added,)
+            self.by_pip = by_pip
+            self._view = None
+            return
+
         self.dominos = self.dominos + list(dominos)
         self.remove_domino((-1, -1))
         self.update_score()
     
     def check_double(self, value):
+        if self.table is not None:
+            if self.mask & self.table.double_masks[value]:
+                return 1
+            return 0
         for dom in self.dominos:
             if (value == dom[0] and value == dom[1]):
                 return 1
         return 0
     
     def winning(self):
+        if self.table is not None:
+            return self.mask == 0
         if len(self.dominos) == 0:
             return True
         else:
-            return False
\ No newline at end of file
+            return False
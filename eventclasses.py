@@ -0,0 +1,342 @@
+import json
+import numpy as np
+import dominoclasses
+import playerclasses
+import recorderclasses
+
+#Event types, the first byte of every event
+ROUND = 0
+DEAL = 1
+DRAW = 2
+DOUBLE = 3
+TURN = 4
+PLAY = 5
+MARKER = 6
+ROUND_END = 7
+
+#Stands in for a missing player, train or domino, like the empty deck's (-1, -1)
+NONE = 255
+
+#Bits of a PLAY event's detail byte
+FLIPPED = 1
+CONTINUES = 2
+
+class LoggedHand:
+    """
+    Stands in for a player's Hand while an EventLog is kept, passing everything through to
+    the hand but logging every domino added to it as a draw by its player
+    """
+
+    def __init__(self, hand, player_num, log):
+        self.hand = hand
+        self.player_num = player_num
+        self.log = log
+
+    def __getattr__(self, name):
+        return getattr(self.hand, name)
+
+    def add_dominos(self, dominos):
+        self.log.draw(self.player_num, dominos)
+        self.hand.add_dominos(dominos)
+
+class LoggedTrain:
+    """
+    Stands in for a Train while an EventLog is kept, passing everything through to the train
+    but logging the dominos added to it as a play by the current player, and its marker changes
+    """
+
+    def __init__(self, train, t_num, log):
+        self.train = train
+        self.t_num = t_num
+        self.log = log
+
+    def __getattr__(self, name):
+        return getattr(self.train, name)
+
+    def add_train(self, dominos):
+        self.log.play(self.t_num, dominos)
+        self.train.add_train(dominos)
+
+    def set_marker(self, marker):
+        self.log.marker(self.t_num, marker)
+        self.train.set_marker(marker)
+
+class EventLog:
+    """
+    A compact binary log of everything that happened in one game, kept by mtrain.mexicantrain
+    when passed in as its log.
+
+    Every event is 5 bytes: the event type, player, train, domino and a detail byte, with
+    dominos stored as their dominoclasses.DominoTable index and NONE where a field isn't used:
+    - ROUND: a round starts, with its number as the detail
+    - DEAL: a domino dealt to a player
+    - DRAW: a domino drawn by a player, NONE when the deck was empty
+    - DOUBLE: the player holding the round's double plays it to start the round
+    - TURN: a player's turn starts
+    - PLAY: a domino added to a train by the current player. The detail has FLIPPED set if the
+      domino was played the other way around from its table order, and CONTINUES set if it was
+      placed along with the domino before it (a train, or a double and its followup)
+    - MARKER: a train's marker is set, to the detail
+    - ROUND_END: the round is over
+    header holds the number of players, domino size, modes and seed of the game.
+
+    Player decisions aren't logged, only what they did, so a GameReplay can rebuild the exact
+    state of the game at every decision without running any player logic.
+    """
+
+    def __init__(self, events=b"", header=None):
+        self.events = bytearray(events)
+        self.header = header
+        self.table = None
+        self.current_player = NONE
+        if header is not None:
+            self.table = dominoclasses.domino_table(header["domino_size"])
+
+    def add(self, event, player=NONE, train=NONE, domino=NONE, detail=0):
+        self.events += bytes((event, player, train, domino, detail))
+
+    def index_of(self, domino):
+        if domino[0] < 0:
+            return NONE
+        return self.table.index[domino]
+
+    def start_game(self, num_players, domino_size, modes, seed):
+        self.header = {"num_players": num_players, "domino_size": domino_size,
+                       "modes": list(modes), "seed": seed}
+        self.table = dominoclasses.domino_table(domino_size)
+
+    def start_round(self, round_number):
+        self.add(ROUND, detail=round_number)
+
+    def deal(self, hands):
+        """
+        Logs the dominos each hand was dealt
+        Returns the hands wrapped in LoggedHands so later draws are logged
+        """
+        logged = []
+        for player_num in range(0, len(hands)):
+            for domino in hands[player_num].dominos:
+                self.add(DEAL, player_num, domino=self.index_of(domino))
+            logged.append(LoggedHand(hands[player_num], player_num, self))
+        return logged
+
+    def watch_trains(self, trains):
+        """
+        Returns the trains wrapped in LoggedTrains so plays and markers are logged
+        """
+        return [LoggedTrain(trains[t_num], t_num, self) for t_num in range(0, len(trains))]
+
+    def start_double(self, player_num):
+        self.add(DOUBLE, player_num)
+
+    def turn(self, player_num):
+        self.current_player = player_num
+        self.add(TURN, player_num)
+
+    def draw(self, player_num, dominos):
+        for domino in dominos:
+            self.add(DRAW, player_num, domino=self.index_of(domino))
+
+    def play(self, t_num, dominos):
+        detail = 0
+        for domino in dominos:
+            if domino[0] > domino[1]:
+                detail |= FLIPPED
+            self.add(PLAY, self.current_player, t_num, self.index_of(domino), detail)
+            detail = CONTINUES
+
+    def marker(self, t_num, marker):
+        self.add(MARKER, train=t_num, detail=int(bool(marker)))
+
+    def end_round(self):
+        self.add(ROUND_END)
+
+    def to_array(self):
+        """
+        Returns the events as a uint8 array with a row per event
+        """
+        return np.frombuffer(bytes(self.events), dtype=np.uint8).reshape(-1, 5)
+
+def save_logs(path, logs):
+    """
+    Saves a list of EventLogs to one compressed .npz file, with the events of every game
+    stored end to end, the offset each game starts at, and the headers as JSON
+    """
+    starts = [0]
+    for log in logs:
+        starts.append(starts[-1] + len(log.events) // 5)
+    events = np.frombuffer(b"".join(bytes(log.events) for log in logs), dtype=np.uint8).reshape(-1, 5)
+    np.savez_compressed(path, events=events, starts=np.array(starts, dtype=np.int64),
+                        headers=np.array(json.dumps([log.header for log in logs])))
+
+def load_logs(path):
+    """
+    Returns the list of EventLogs saved to path by save_logs
+    """
+    with np.load(path) as saved:
+        events = saved["events"]
+        starts = saved["starts"]
+        headers = json.loads(str(saved["headers"]))
+    return [EventLog(events[starts[game_num]:starts[game_num + 1]].tobytes(), headers[game_num])
+            for game_num in range(0, len(headers))]
+
+class ReplayState:
+    """
+    The state of a game right before a placement, as rebuilt by GameReplay.
+    hands and trains are the Hand and Train objects of the replay, so they only hold this
+    state until the replay moves on.
+
+    play is the list of dominos the player placed on train t_num, oriented as played.
+    opening is set for a player starting their own train, and cover for a domino covering a
+    double, which mtrain asks the player for with play_forced_double rather than play_normally
+    """
+
+    def __init__(self, replay, play, t_num, opening, cover):
+        self.round_number = replay.round_number
+        self.turn_number = replay.turn_number
+        self.player_number = replay.current_player
+        self.hands = replay.hands
+        self.trains = replay.trains
+        self.play = play
+        self.t_num = t_num
+        self.opening = opening
+        self.cover = cover
+        self.table = replay.table
+
+    def hand(self):
+        return self.hands[self.player_number].dominos
+
+    def unknown(self):
+        """
+        Returns the dominos the player can't see: every domino not in their hand, on a train
+        or the round's double, which is the rest of the deck and the other players' hands
+        """
+        seen = set(self.hand())
+        seen.add((self.round_number, self.round_number))
+        for train in self.trains:
+            for domino in train.train_list:
+                seen.add(self.table.dominos[self.table.index[domino]])
+        return [domino for domino in self.table.dominos if not domino in seen]
+
+    def potential_plays(self):
+        """
+        Returns the dominos the player could have played, as recorded in data_collection mode:
+        the dominos matching the double for a cover, otherwise the last domino of every play
+        the move generators find on the player's own train and the trains with markers up
+        """
+        generator = playerclasses.GreedyPlayer(self.player_number)
+        if self.cover:
+            return [play[1] for play in generator.can_play_on_single(self.hand(), [self.trains[self.t_num].get_last()])]
+        targets = []
+        for x in range(0, len(self.trains)):
+            train = self.trains[x]
+            if train.marker_up or x == self.player_number:
+                if train.get_last() == (-1, -1):
+                    targets.append((self.round_number, self.round_number))
+                else:
+                    targets.append(train.get_last())
+        potential_plays = [generator.can_play_on_single(self.hand(), targets),
+                           generator.can_play_on_double_good(self.hand(), targets),
+                           generator.can_play_on_double_bad(self.hand(), targets)]
+        dominos = []
+        for potentials in potential_plays:
+            for play in potentials:
+                dominos.append(play[-1])
+        return dominos
+
+class GameReplay:
+    """
+    Replays an EventLog, rebuilding the hands, trains and markers of the game event by event.
+
+    decisions yields a ReplayState right before every placement of the game, and end_round
+    is called with the round number and hand scores as each round ends, so new features can
+    be computed for old games from their logs alone
+    """
+
+    def __init__(self, log):
+        self.log = log
+        self.num_players = log.header["num_players"]
+        self.domino_size = log.header["domino_size"]
+        self.table = dominoclasses.domino_table(self.domino_size)
+        self.round_number = -1
+        self.turn_number = 0
+        self.current_player = -1
+        self.hands = []
+        self.trains = []
+        self.uncovered = -1
+
+    def start_round(self, round_number):
+        self.round_number = round_number
+        self.turn_number = 0
+        self.current_player = -1
+        self.hands = [dominoclasses.Hand([]) for player_num in range(0, self.num_players)]
+        self.trains = [dominoclasses.Train() for t_num in range(0, self.num_players + 1)]
+        self.trains[self.num_players].set_marker(True)
+        self.uncovered = -1
+
+    def domino(self, index, detail=0):
+        domino = self.table.dominos[index]
+        if detail & FLIPPED:
+            return (domino[1], domino[0])
+        return domino
+
+    def decisions(self, end_round=None):
+        """
+        Yields a ReplayState before each placement, then makes the placement
+        """
+        events = self.log.to_array()
+        event_num = 0
+        while event_num < events.shape[0]:
+            event, player, train, domino, detail = [int(value) for value in events[event_num]]
+            event_num += 1
+            if event == ROUND:
+                self.start_round(detail)
+            elif event == DEAL or event == DRAW:
+                if domino != NONE:
+                    self.hands[player].add_dominos([self.domino(domino)])
+            elif event == DOUBLE:
+                self.hands[player].remove_domino((self.round_number, self.round_number))
+            elif event == TURN:
+                self.current_player = player
+                self.turn_number += 1
+            elif event == MARKER:
+                self.trains[train].set_marker(detail == 1)
+            elif event == ROUND_END:
+                if end_round is not None:
+                    end_round(self.round_number, [hand.score for hand in self.hands])
+            elif event == PLAY:
+                play = [self.domino(domino, detail)]
+                while event_num < events.shape[0] and events[event_num, 0] == PLAY \
+                        and events[event_num, 4] & CONTINUES:
+                    play.append(self.domino(int(events[event_num, 3]), int(events[event_num, 4])))
+                    event_num += 1
+                opening = train == self.current_player and self.trains[train].empty()
+                cover = train == self.uncovered
+                yield ReplayState(self, play, train, opening, cover)
+
+                self.trains[train].add_train(play)
+                for placed in play:
+                    self.hands[self.current_player].remove_domino(placed)
+                #A double placed alone, other than at the end of a player's opening train,
+                #has to be covered by the next domino placed on its train
+                if cover:
+                    self.uncovered = -1
+                elif not opening and len(play) == 1 and play[0][0] == play[0][1]:
+                    self.uncovered = train
+
+def replay_rows(log, recorder=None):
+    """
+    Replays a game's EventLog into a recorderclasses.RowRecorder, recording the same rows
+    mexicantrain records in data_collection mode: every placement but the opening trains
+    Returns the recorder
+    """
+    replay = GameReplay(log)
+    if recorder is None:
+        recorder = recorderclasses.RowRecorder(replay.num_players, replay.domino_size)
+    for state in replay.decisions(recorder.end_round):
+        if state.opening:
+            continue
+        recorder.record(state.round_number, state.turn_number / replay.num_players, state.player_number,
+                        state.play, state.t_num, state.hand(), state.unknown(), state.potential_plays(),
+                        state.trains)
+    return recorder
@@ -1,14 +1,24 @@
 import random
+import multiprocessing
 import treeclasses
 import playerclasses
 import dominoclasses
+import recorderclasses
 import pandas as pd
 import numpy as np
-import copy
+import time
+import statsclasses
+import stateclasses
+import eventclasses
 
-def generate_players(num_players, modes, domino_size, filename):
+#Hand size rule, indexed by the number of players less two
+hand_sizes = [16, 16, 15, 14, 12, 10, 9]
+
+def generate_players(num_players, modes, domino_size, filename, predictor=None, rng=None):
     """
     Creates player objects based on modes passed to this script
+    Neural players hand their predictions to predictor if one is given (see NeuralPlayer)
+    Random and Rollout players choose their plays with rng if one is given, otherwise the random module
     Returns a list of the player objects in order of creation
     """
     players = []
@@ -16,48 +26,196 @@ def generate_players(num_players, modes, domino_size, filename):
         if modes[num] == "Greedy":
             players.append(playerclasses.GreedyPlayer(num))
         elif modes[num] == "Random":
-            players.append(playerclasses.RandomPlayer(num))
+            players.append(playerclasses.RandomPlayer(num, rng))
         elif modes[num] == "Probability":
             players.append(playerclasses.ProbabilityPlayer(num, domino_size))
         elif modes[num] == "Neural":
-            players.append(playerclasses.NeuralPlayer(num, domino_size, filename, num_players))
+            players.append(playerclasses.NeuralPlayer(num, domino_size, filename, num_players, predictor))
+        elif modes[num] == "Rollout":
+            players.append(playerclasses.RolloutPlayer(num, rng=rng))
     return players
 
 def create_one_hot(domino_size, dominos):
     """
-    Creates a list of 0s and 1s where each 0 or 1 corresponds to having a specific domino
+    Creates an array of 0s and 1s where each 0 or 1 corresponds to having a specific domino
     Used for collecting data on what dominos are in a hand, in a train, etc. 
     This is later decoded when training the neural net
+
+    The encoding is done by the shared dominoclasses.DominoTable for domino_size
     """
-    domino_count = int(domino_size + 1 + ((domino_size + 1) * domino_size) / 2.0)
-    one_hot = np.zeros(domino_count)
-    for domino in dominos:
-        try:
-            location = int(max(domino) * (domino_size + 1 - (max(domino) + 1) / 2.0) + min(domino))
-        except TypeError:
-            print(dominos)
-            print(type(domino))
-            print(domino)
-            print(domino[0])
-            print(domino[1])
-            raise TypeError
-        one_hot[location] = 1
-    return one_hot.tolist()
+    return dominoclasses.domino_table(domino_size).encode(dominos)
 
-def strip_potential_plays(potential_plays, domino_size):
+def flatten_potential_plays(potential_plays):
     """
     Filters through potential_plays (A matrix of plays) and creates a list of all dominos potentially to be played
-    Returns a one_hot of the dominos that can potentially be played
     """
     dominos = []
     for potentials in potential_plays:
         for play in potentials:
             dominos.append(play[-1])
-    return create_one_hot(domino_size, dominos)
+    return dominos
+
+def strip_potential_plays(potential_plays, domino_size):
+    """
+    Filters through potential_plays (A matrix of plays) and creates a list of all dominos potentially to be played
+    Returns a one_hot of the dominos that can potentially be played
+    """
+    return create_one_hot(domino_size, flatten_potential_plays(potential_plays))
+
+def unknown_dominos(deck, hands, current_player):
+    """
+    Returns the dominos the current player can't see: the rest of the deck and every other player's hand
+    """
+    unknown = list(deck.dominos)
+    for x in range(0, len(hands)):
+        if not x == current_player:
+            unknown += hands[x].dominos
+    return unknown
+
+
+def draw_dominos(deck, hand, player, number=1, stats=None):
+    """
+    Draws dominos from the deck into a player's hand, and tells the player what it drew,
+    counting the dominos actually drawn in stats (an empty deck gives the (-1, -1) domino)
+    """
+    dominos = deck.draw(number)
+    hand.add_dominos(dominos)
+    player.drew(dominos)
+    if stats is not None:
+        stats.count("draws", len([domino for domino in dominos if domino != (-1, -1)]))
+
+def place_dominos(players, train, dominos):
+    """
+    Adds dominos to the end of a train, and shows the play to every player
+    """
+    train.add_train(dominos)
+    for player in players:
+        player.saw_play(dominos)
+
+def create_deck(domino_size, compact=False, rng=None, stats=None):
+    """
+    Creates a shuffled deck, timing the shuffle and the deck's draws when stats are being kept
+    """
+    if stats is None:
+        return dominoclasses.Deck(domino_size, compact=compact, rng=rng)
+    start = time.perf_counter()
+    deck = dominoclasses.Deck(domino_size, compact=compact, rng=rng)
+    stats.add_time("deck", time.perf_counter() - start)
+    return stats.timed(deck, statsclasses.deck_phases, "Deck")
+
+def record_play(recorder, round_number, turn_number, player_number, play, t_num, deck, hands, 
+                potential_plays, trains):
+    """
+    Records a play in data_collection mode, along with the dominos the player couldn't see
+    """
+    recorder.record(round_number, turn_number, player_number, play, t_num, hands[player_number].dominos,
+                    unknown_dominos(deck, hands, player_number), potential_plays, trains)
+
+def find_winner(scores):
+    """
+    Returns the index of the player with the lowest score, the first one winning any ties
+    """
+    lowest_score = 1000000
+    index = -1
+    for playernum in range(0, len(scores)):
+        if scores[playernum] < lowest_score:
+            lowest_score = scores[playernum]
+            index = playernum
+    return index
 
+def play_round(task):
+    """
+    Plays a single round of a game for play_rounds_apart. task is a tuple of
+    (round_number, seed, deal_seed, collect_stats, collect_log, game), game being a dict of the
+    keyword arguments of the game
+    Returns the results of mexicantrain for that round alone, followed by its
+    statsclasses.GameStats and eventclasses.EventLog, each None if not collected
+    """
+    round_number, seed, deal_seed, collect_stats, collect_log, game = task
+    stats = None
+    if collect_stats:
+        stats = statsclasses.GameStats()
+    log = None
+    if collect_log:
+        log = eventclasses.EventLog()
+    results = mexicantrain(rounds=[round_number], seed=seed, deal_seed=deal_seed, stats=stats, log=log, **game)
+    return results + (stats, log)
+
+def play_rounds_apart(num_players, domino_size, data_collection, debug, modes, data_index, file_name,
+                      compact, data_format, predictor, seed, deal_seed, stats, log, rounds, round_workers):
+    """
+    Plays the rounds of a game of mexicantrain independently, on a pool of round_workers
+    processes when there is more than one, and puts the results back together in round order.
+    Every round is a separate call of mexicantrain with its own seed, drawn from a
+    random.Random(seed) stream in round order, and its own deal seed drawn the same way from
+    deal_seed if one is given.
+    Stats from every round are merged, so their times add up the time of every round across
+    the processes. The log holds the events of every round in order, with the round seeds
+    added to its header.
+    Returns the same as mexicantrain
+    """
+    if predictor is not None and round_workers > 1:
+        raise ValueError("predictor can't be passed to other processes, use round_workers=1")
+    if rounds is None:
+        rounds = range(domino_size, -1, -1)
+    if len(rounds) == 0:
+        #With no rounds to play there's nothing to spread out, so return the empty game as is
+        return mexicantrain(num_players, domino_size, data_collection, debug, modes, data_index, file_name,
+                            compact, data_format, predictor, seed, stats, log, rounds=[], deal_seed=deal_seed)
+    rng = random.Random(seed)
+    round_seeds = [rng.randrange(2**32) for round_number in rounds]
+    round_deal_seeds = [None for round_number in rounds]
+    if deal_seed is not None:
+        deal_rng = random.Random(deal_seed)
+        round_deal_seeds = [deal_rng.randrange(2**32) for round_number in rounds]
+    game = {"num_players": num_players, "domino_size": domino_size, "data_collection": data_collection,
+            "debug": debug, "modes": modes, "data_index": 0, "file_name": file_name, "compact": compact,
+            "data_format": data_format}
+    tasks = [(rounds[round_num], round_seeds[round_num], round_deal_seeds[round_num], stats is not None,
+              log is not None, game)
+             for round_num in range(0, len(rounds))]
+
+    if round_workers > 1:
+        #Leaving the with block terminates the pool, so a failed round doesn't wait on the others
+        with multiprocessing.Pool(round_workers) as pool:
+            round_results = pool.map(play_round, tasks)
+    else:
+        if predictor is not None:
+            game["predictor"] = predictor
+        round_results = [play_round(task) for task in tasks]
+
+    scores = [0 for playernum in range(0, num_players)]
+    for results in round_results:
+        for playernum in range(0, num_players):
+            scores[playernum] += results[0][playernum]
+        if stats is not None:
+            stats.merge(results[3])
+    if stats is not None:
+        #Every round counted itself as a game
+        stats.count("games", 1 - len(round_results))
+    if log is not None:
+        log.start_game(num_players, domino_size, modes, seed)
+        log.header["round_seeds"] = round_seeds
+        for results in round_results:
+            log.events += results[4].events
+
+    data = round_results[0][2]
+    if data_collection and data_format == "arrays":
+        data = {}
+        for name in round_results[0][2]:
+            data[name] = np.concatenate([results[2][name] for results in round_results])
+    elif data_collection:
+        data = pd.concat([results[2] for results in round_results])
+        data.index = range(data_index, data_index + data.shape[0])
+
+    index = find_winner(scores)
+    if debug: print("Game over, player" + str(index) + " won")
+    return scores, index, data
 
 def mexicantrain(num_players=2, domino_size=12, data_collection=False, debug=True, 
-                 modes=["Greedy", "Random"], data_index=0, file_name="PlayData/data2_12_100"):
+                 modes=["Greedy", "Random"], data_index=0, file_name="PlayData/data2_12_100",
+                 compact=False, data_format="dataframe", predictor=None, seed=None, stats=None,
+                 log=None, rounds=None, round_workers=None, deal_seed=None):
     """
     A function that runs a single game of mexican train from start to finish. A full guide of the
     rules can be found in the README.MD file. 
@@ -67,50 +225,115 @@ def mexicantrain(num_players=2, domino_size=12, data_collection=False, debug=Tru
 
     When not using a Neural player, file_name does not matter
 
+    When compact is on, hands, trains and decks also keep their dominos as bitmasks
+    (see dominoclasses.DominoTable), which makes removals, score updates and double checks O(1).
+    The game plays out exactly the same either way.
+
+    In data_collection mode the rows are gathered by a recorderclasses.RowRecorder. With
+    data_format="dataframe" the data is returned as a DataFrame indexed from data_index,
+    with data_format="arrays" it is returned as the recorder's dict of NumPy arrays.
+
+    predictor is passed on to any Neural players, which use it in place of calling their network
+    directly. mtrainsimulator uses this to batch the predictions of many games together.
+
+    When a seed is given the game gets its own random.Random(seed), which shuffles every deck
+    and makes the Random players' choices, so the game plays out the same every time no
+    matter what else is using the random module. Without one the random module is used.
+    With a deal_seed as well, the decks are shuffled from their own random.Random(deal_seed)
+    instead, so the same hands are dealt every round no matter how the players play or which
+    seats they sit in. This is what duplicate tournaments use (see tournament.run_tournament).
+
+    stats takes a statsclasses.GameStats, which is filled in with the time spent in each phase
+    of the game, the calls to each player method by mode and counts of draws, forced doubles,
+    doom counter endings and turns per round. The players, decks and recorder are only
+    wrapped in timers when stats are given, so leaving it off costs nothing.
+
+    log takes an eventclasses.EventLog, which records the deals, draws, plays and markers of
+    the game so it can be replayed later (see eventclasses.GameReplay). The hands and trains
+    are only wrapped to log their changes when a log is given.
+
+    rounds is the list of round numbers to play, in order, and defaults to every round from
+    domino_size down to 0. Since each round is dealt from a fresh deck and only the score totals
+    carry over, the rounds can also be played apart: with round_workers set, each round gets
+    its own random stream, seeded from a random.Random(seed) stream in round order, and the
+    rounds are played on a pool of round_workers processes (or one after another in this process
+    if round_workers is 1; see play_rounds_apart). The scores, data, stats and log are put back
+    together in round order, so the game plays out the same for any number of round_workers,
+    but not the same as the game with the same seed and round_workers left unset.
+
     Returns the scores, the index of the winning player, and the data collected if in data_collection mode
     """
+    if round_workers is not None:
+        return play_rounds_apart(num_players, domino_size, data_collection, debug, modes, data_index,
+                                 file_name, compact, data_format, predictor, seed, deal_seed, stats, log,
+                                 rounds, round_workers)
+    game_start = time.perf_counter()
+
     #Check player number
     if not num_players in range(2, 9):
         raise ValueError("Number of players must be between 2 and 8, inclusive")
     
-    #Set up DataFrame for data collection mode
-    column_names = ["round_number", "turn_number", "player_number", "play", 
-                "t_num", "hand", "unknown", "potential_plays", "points"]
-    for num in range(0, num_players + 1):
-        column_names.append("train_" + str(num))
-        column_names.append("marker_" + str(num))
-
-    data = pd.DataFrame(dtype=object, columns=column_names)
+    #Set up the row recorder for data collection mode
+    recorder = None
+    record = record_play
+    if data_collection:
+        recorder = recorderclasses.RowRecorder(num_players, domino_size)
+        if stats is not None:
+            recorder = stats.timed(recorder, statsclasses.recorder_phases, "RowRecorder")
+            record = stats.timed_function(record_play, "recording", "RowRecorder.record")
 
     #Hand size rule
-    hand_sizes = [16, 16, 15, 14, 12, 10, 9]
     hand_size = hand_sizes[num_players - 2]
 
     scores = []
     for ind in range(0, num_players):
         scores.append(0)
 
+    #Give the game its own random stream if seeded
+    rng = None
+    if seed is not None:
+        rng = random.Random(seed)
+
     #Generate the players for the game
-    players = generate_players(num_players, modes, domino_size, file_name)
+    players = generate_players(num_players, modes, domino_size, file_name, predictor, rng)
+    deal_rng = rng
+    if deal_seed is not None:
+        deal_rng = random.Random(deal_seed)
+    if log is not None:
+        log.start_game(num_players, domino_size, modes, seed)
+    if stats is not None:
+        players = [stats.timed(players[num], statsclasses.player_phases, modes[num]) 
+                   for num in range(0, num_players)]
 
     #Start game
-    for round_number in range(domino_size, -1, -1):
+    if rounds is None:
+        rounds = range(domino_size, -1, -1)
+    for round_number in rounds:
         if debug: print("Round start: " + str(round_number))
+        if log is not None: log.start_round(round_number)
 
         #Create Shuffled Deck
         if debug: print("Creating Deck")
-        deck = dominoclasses.Deck(domino_size)
+        deck = create_deck(domino_size, compact, deal_rng, stats)
         trains = []
         for playernum in range(0, num_players + 1):
-            trains.append(dominoclasses.Train())
+            if compact:
+                trains.append(dominoclasses.Train(domino_size))
+            else:
+                trains.append(dominoclasses.Train())
         trains[num_players].set_marker(True)
+        if log is not None: trains = log.watch_trains(trains)
 
         #Generate Random Hands for each player
         if debug: print("Creating Hands")
         hands = []
         for playernum in range(0, num_players):
             dominos = deck.draw(hand_size)
-            hands.append(dominoclasses.Hand(dominos))
+            if compact:
+                hands.append(dominoclasses.Hand(dominos, domino_size))
+            else:
+                hands.append(dominoclasses.Hand(dominos))
+        if log is not None: hands = log.deal(hands)
         
         #Check who has the current target double, if no one has it, everyone draws one domino
         if debug: print("Checking for player with needed domino:")
@@ -130,6 +353,11 @@ def mexicantrain(num_players=2, domino_size=12, data_collection=False, debug=Tru
             else:
                 break
         if debug: print("Domino found, round beginning")
+        if log is not None: log.start_double(start_player)
+
+        #Let the players know the round has started and what they were dealt
+        for playernum in range(0, num_players):
+            players[playernum].start_round(round_number, hands[playernum].dominos)
         #Start round
 
         round_over = False
@@ -139,8 +367,13 @@ def mexicantrain(num_players=2, domino_size=12, data_collection=False, debug=Tru
         turn_number = 1
         while not round_over:
             if debug: print("Player " + str(current_player) + " is now playing")
+            if log is not None: log.turn(current_player)
             end_turn = False
             active_player = players[current_player]
+            if active_player.needs_state:
+                active_player.see_state(stateclasses.GameState.from_game(round_number, domino_size, hands, trains, deck,
+                                                                         current_player, turn_number, double_up,
+                                                                         doom_counter))
             #If another player has played a double, the double must be covered
             if double_up[0]:
                 #Get potential play
@@ -151,7 +384,7 @@ def mexicantrain(num_players=2, domino_size=12, data_collection=False, debug=Tru
                 #If no play exists, try again
                 if len(play) == 0:
                     if debug: print("No play available, drawing again")
-                    hands[current_player].add_dominos(deck.draw(1))
+                    draw_dominos(deck, hands[current_player], active_player, stats=stats)
                     if debug: print("Current player's hand is: " + str(hands[current_player].dominos))
                     play, play_data = active_player.play_forced_double(hands[current_player].dominos, trains[double_up[1]])
                     if len(play) == 0:
@@ -163,30 +396,11 @@ def mexicantrain(num_players=2, domino_size=12, data_collection=False, debug=Tru
                 if not end_turn:
                     #Collect data on the play if necessary
                     if data_collection:
-                        data.loc[data_index, "round_number"] = round_number
-                        data.loc[data_index, "turn_number"] = turn_number / num_players
-                        data.loc[data_index, "player_number"] = current_player
-                        data.loc[data_index, "play"] = create_one_hot(domino_size, play)
-                        data.loc[data_index, "t_num"] = double_up[1]
-                        data.loc[data_index, "hand"] = create_one_hot(domino_size, hands[current_player].dominos)
-                        unknown = copy.deepcopy(deck.dominos)
-                        for x in range(0, len(hands)):
-                            if x == current_player:
-                                continue
-                            else:
-                                unknown += hands[x].dominos
-                        data.loc[data_index, "unknown"] = create_one_hot(domino_size, unknown)
-                        data.loc[data_index, "potential_plays"] = create_one_hot(domino_size, play_data)
-                        for x in range(0, len(trains)):
-                            data.loc[data_index, "train_" + str(x)] = create_one_hot(domino_size, trains[x].train_list)
-                            if trains[x].marker_up:
-                                data.loc[data_index, "marker_" + str(x)] = 1
-                            else:
-                                data.loc[data_index, "marker_" + str(x)] = 0
-                        data_index += 1
+                        record(recorder, round_number, turn_number / num_players, current_player, play, double_up[1],
+                               deck, hands, play_data, trains)
                     
                     #Play the play onto the target train and remove from hand
-                    trains[double_up[1]].add_domino(play[0])
+                    place_dominos(players, trains[double_up[1]], [play[0]])
                     for pl in play:
                         hands[current_player].remove_domino(pl)
                     
@@ -201,7 +415,7 @@ def mexicantrain(num_players=2, domino_size=12, data_collection=False, debug=Tru
 
                 #Verify an actual train is being played, if not draw and try again
                 if len(play) == 0:
-                    hands[current_player].add_dominos(deck.draw(1))
+                    draw_dominos(deck, hands[current_player], active_player, stats=stats)
                     play = active_player.play_train(hands[current_player].dominos, round_number)
                     if len(play) == 0:
                         trains[current_player].set_marker(True)
@@ -211,13 +425,13 @@ def mexicantrain(num_players=2, domino_size=12, data_collection=False, debug=Tru
                 #Play the train the player came up with
                 if not end_turn:
                     doom_counter = 0
-                    trains[current_player].add_train(play)
+                    place_dominos(players, trains[current_player], play)
                     for pl in play:
                         hands[current_player].remove_domino(pl)
                     
                     #Check if the final domino played is a double, if so deal with that case
                     if(play[-1][0] == play[-1][1]):
-                        hands[current_player].add_dominos(deck.draw(1))
+                        draw_dominos(deck, hands[current_player], active_player, stats=stats)
                         play = active_player.play_forced_double(hands[current_player].dominos, trains[double_up[1]])
                         if len(play) == 0:
                             trains[current_player].set_marker(True)
@@ -232,7 +446,7 @@ def mexicantrain(num_players=2, domino_size=12, data_collection=False, debug=Tru
                 
                 #If the play doesn't exist, try again and process this
                 if len(play) == 0:
-                    hands[current_player].add_dominos(deck.draw(1))
+                    draw_dominos(deck, hands[current_player], active_player, stats=stats)
                     t_num, play, play_data = active_player.play_normally(hands[current_player].dominos, trains, round_number, turn_number)
                     if len(play) == 0:
                         trains[current_player].set_marker(True)
@@ -246,70 +460,33 @@ def mexicantrain(num_players=2, domino_size=12, data_collection=False, debug=Tru
                     if len(play) == 1 and not (play[0][0] == play[0][1]):
                         #Collect data as necessary
                         if data_collection:
-                            data.loc[data_index, "round_number"] = round_number
-                            data.loc[data_index, "turn_number"] = turn_number / num_players
-                            data.loc[data_index, "player_number"] = current_player
-                            data.loc[data_index, "play"] = create_one_hot(domino_size, play)
-                            data.loc[data_index, "t_num"] = t_num
-                            data.loc[data_index, "hand"] = create_one_hot(domino_size, hands[current_player].dominos)
-                            unknown = copy.deepcopy(deck.dominos)
-                            for x in range(0, len(hands)):
-                                if x == current_player:
-                                    continue
-                                else:
-                                    unknown += hands[x].dominos
-                            data.loc[data_index, "unknown"] = create_one_hot(domino_size, unknown)
-                            data.loc[data_index, "potential_plays"] = strip_potential_plays(play_data, domino_size)
-                            for x in range(0, len(trains)):
-                                data.loc[data_index, "train_" + str(x)] = create_one_hot(domino_size, trains[x].train_list)
-                                if trains[x].marker_up:
-                                    data.loc[data_index, "marker_" + str(x)] = 1
-                                else:
-                                    data.loc[data_index, "marker_" + str(x)] = 0
-                            data_index += 1
+                            record(recorder, round_number, turn_number / num_players, current_player, play, t_num,
+                                   deck, hands, flatten_potential_plays(play_data), trains)
                         
                         #Play domino on train and remove it from the player's hand
-                        trains[t_num].add_domino(play[0])
+                        place_dominos(players, trains[t_num], [play[0]])
                         for pl in play:
                             hands[current_player].remove_domino(pl)
                     #Single play that is a double, signally cover double mode
                     elif len(play) == 1 and (play[0][0] == play[0][1]):
                         #Collect data as necessary
                         if data_collection:
-                            data.loc[data_index, "round_number"] = round_number
-                            data.loc[data_index, "turn_number"] = turn_number / num_players
-                            data.loc[data_index, "player_number"] = current_player
-                            data.loc[data_index, "play"] = create_one_hot(domino_size, play)
-                            data.loc[data_index, "t_num"] = t_num
-                            data.loc[data_index, "hand"] = create_one_hot(domino_size, hands[current_player].dominos)
-                            unknown = copy.deepcopy(deck.dominos)
-                            for x in range(0, len(hands)):
-                                if x == current_player:
-                                    continue
-                                else:
-                                    unknown += hands[x].dominos
-                            data.loc[data_index, "unknown"] = create_one_hot(domino_size, unknown)
-                            data.loc[data_index, "potential_plays"] = strip_potential_plays(play_data, domino_size)
-                            for x in range(0, len(trains)):
-                                data.loc[data_index, "train_" + str(x)] = create_one_hot(domino_size, trains[x].train_list)
-                                if trains[x].marker_up:
-                                    data.loc[data_index, "marker_" + str(x)] = 1
-                                else:
-                                    data.loc[data_index, "marker_" + str(x)] = 0
-                            data_index += 1
+                            record(recorder, round_number, turn_number / num_players, current_player, play, t_num,
+                                   deck, hands, flatten_potential_plays(play_data), trains)
                         
                         #Play domino and remove from hand of player
-                        trains[t_num].add_domino(play[0])
+                        place_dominos(players, trains[t_num], [play[0]])
                         for pl in play:
                             hands[current_player].remove_domino(pl)
                         
                         #Draw to attempt to cover the domino
-                        hands[current_player].add_dominos(deck.draw(1))
+                        draw_dominos(deck, hands[current_player], active_player, stats=stats)
                         play_2, play_data_2 = active_player.play_forced_double(hands[current_player].dominos, trains[t_num])
                         
                         #If no play is available, start double_up mode
                         if len(play_2) == 0:
                             double_up = (True, t_num)
+                            if stats is not None: stats.count("forced_double_episodes")
                             trains[current_player].set_marker(True)
                             end_turn = True
                         
@@ -317,30 +494,11 @@ def mexicantrain(num_players=2, domino_size=12, data_collection=False, debug=Tru
                         if not end_turn:
                             #Collect Data as neccesary
                             if data_collection:
-                                data.loc[data_index, "round_number"] = round_number
-                                data.loc[data_index, "turn_number"] = turn_number / num_players
-                                data.loc[data_index, "player_number"] = current_player
-                                data.loc[data_index, "play"] = create_one_hot(domino_size, play_2)
-                                data.loc[data_index, "t_num"] = t_num
-                                data.loc[data_index, "hand"] = create_one_hot(domino_size, hands[current_player].dominos)
-                                unknown = copy.deepcopy(deck.dominos)
-                                for x in range(0, len(hands)):
-                                    if x == current_player:
-                                        continue
-                                    else:
-                                        unknown += hands[x].dominos
-                                data.loc[data_index, "unknown"] = create_one_hot(domino_size, unknown)
-                                data.loc[data_index, "potential_plays"] = create_one_hot(domino_size, play_data_2)
-                                for x in range(0, len(trains)):
-                                    data.loc[data_index, "train_" + str(x)] = create_one_hot(domino_size, trains[x].train_list)
-                                    if trains[x].marker_up:
-                                        data.loc[data_index, "marker_" + str(x)] = 1
-                                    else:
-                                        data.loc[data_index, "marker_" + str(x)] = 0
-                                data_index += 1
+                                record(recorder, round_number, turn_number / num_players, current_player, play_2, t_num,
+                                       deck, hands, play_data_2, trains)
 
                             #Play domino drawn to train and remove from hand
-                            trains[t_num].add_domino(play_2[0])
+                            place_dominos(players, trains[t_num], [play_2[0]])
                             for pl in play_2:
                                 hands[current_player].remove_domino(pl)
                     
@@ -348,30 +506,10 @@ def mexicantrain(num_players=2, domino_size=12, data_collection=False, debug=Tru
                     else:
                         #Collect Data as needed
                         if data_collection:
-                            data.loc[data_index, "round_number"] = round_number
-                            data.loc[data_index, "turn_number"] = turn_number / num_players
-                            data.loc[data_index, "player_number"] = current_player
-                            data.loc[data_index, "play"] = create_one_hot(domino_size, play)
-                            data.loc[data_index, "t_num"] = t_num
-                            data.loc[data_index, "hand"] = create_one_hot(domino_size, hands[current_player].dominos)
-                            unknown = copy.deepcopy(deck.dominos)
-                            for x in range(0, len(hands)):
-                                if x == current_player:
-                                    continue
-                                else:
-                                    unknown += hands[x].dominos
-                            data.loc[data_index, "unknown"] = create_one_hot(domino_size, unknown)
-                            data.loc[data_index, "potential_plays"] = strip_potential_plays(play_data, domino_size)
-                            for x in range(0, len(trains)):
-                                data.loc[data_index, "train_" + str(x)] = create_one_hot(domino_size, trains[x].train_list)
-                                if trains[x].marker_up:
-                                    data.loc[data_index, "marker_" + str(x)] = 1
-                                else:
-                                    data.loc[data_index, "marker_" + str(x)] = 0
-                            data_index += 1
+                            record(recorder, round_number, turn_number / num_players, current_player, play, t_num,
+                                   deck, hands, flatten_potential_plays(play_data), trains)
                         #Play both the dominos to the train and remove from the player's hand
-                        trains[t_num].add_domino(play[0])
-                        trains[t_num].add_domino(play[1])
+                        place_dominos(players, trains[t_num], [play[0], play[1]])
                         for pl in play:
                             hands[current_player].remove_domino(pl)
                         end_turn = True
@@ -394,6 +532,9 @@ def mexicantrain(num_players=2, domino_size=12, data_collection=False, debug=Tru
             turn_number += 1
             if debug and turn_number % 5 == 0: print("Turn %s now", turn_number)
         
+        if stats is not None: stats.end_round(turn_number - 1, doom_counter > num_players * 5)
+        if log is not None: log.end_round()
+
         #Once the round is over, calculate the scores of each player for that round
         round_scores = []
         for playernum in range(0, num_players):
@@ -407,18 +548,23 @@ def mexicantrain(num_players=2, domino_size=12, data_collection=False, debug=Tru
             print(scores)
         #Collect data as needed
         if data_collection:
-            for ind in data.index:
-                data.loc[ind, "points"] = hands[int(data.loc[ind, "player_number"])].score
+            recorder.end_round(round_number, [hand.score for hand in hands])
             
-            
-    #Find overall winner
-    lowest_score = 1000000
-    index = -1
-    for playernum in range(0, num_players):
-        if scores[playernum] < lowest_score:
-            lowest_score = scores[playernum]
-            index = playernum
+    index = find_winner(scores)
     
+    #Build the collected data now that the game is over
+    data = None
+    if data_collection and data_format == "arrays":
+        data = recorder.to_arrays()
+    elif data_collection:
+        data = recorder.to_dataframe(data_index)
+    else:
+        data = recorderclasses.RowRecorder(num_players, domino_size, capacity=0).to_dataframe(data_index)
+
+    if stats is not None:
+        stats.count("games")
+        stats.add_time("total", time.perf_counter() - game_start)
+
     #Return results of game
     if debug: print("Game over, player" + str(index) + " won")
     return scores, index, data
\ No newline at end of file
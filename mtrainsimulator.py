@@ -1,19 +1,170 @@
 import mtrain
+import playerclasses
 import numpy as np
 import pandas as pd
 import random
+import multiprocessing
+import threading
+import itertools
+import datasetclasses
+import arrayengine
+import statsclasses
+import eventclasses
+
+def play_game(game, predictor=None):
+    """
+    Runs a single game for simulate_games. game is a tuple of
+    (seed, num_players, domino_size, modes, collect_data, debug, file_name, data_format, collect_stats,
+     collect_log, deal_seed)
+
+    The game draws its decks and Random player choices from its own stream seeded with the
+    game's seed, so a game plays out the same no matter which process or thread runs it.
+    deal_seed, if not None, shuffles the decks apart from the rest (see mtrain.mexicantrain).
+    predictor is passed on to mtrain.mexicantrain for the Neural players
+    Returns the results of mtrain.mexicantrain, followed by the game's statsclasses.GameStats
+    if collect_stats is on and its eventclasses.EventLog if collect_log is on, each None if not
+    """
+    seed, num_players, domino_size, modes, collect_data, debug, file_name, data_format, collect_stats, \
+        collect_log, deal_seed = game
+    stats = None
+    if collect_stats:
+        stats = statsclasses.GameStats()
+    log = None
+    if collect_log:
+        log = eventclasses.EventLog()
+    results = mtrain.mexicantrain(num_players, domino_size, debug=debug, 
+                                  modes=modes, 
+                                  data_collection=collect_data,
+                                  data_index=0, file_name=file_name,
+                                  data_format=data_format, predictor=predictor, seed=seed,
+                                  stats=stats, log=log, deal_seed=deal_seed)
+    return results + (stats, log)
+
+class LockstepGame:
+    """
+    One game being played by play_games_lockstep. The game runs on its own thread, but only
+    while the scheduler has handed it control, so the games never run at the same time and
+    always take turns in the same order.
+
+    When one of its Neural players needs a prediction, the game stores the request and hands
+    control back to the scheduler, then waits for the scheduler to fill in the response.
+    If the scheduler can't answer, stop makes the waiting prediction raise so the thread ends.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.resume = threading.Semaphore(0)
+        self.paused = threading.Semaphore(0)
+        self.request = None
+        self.response = None
+        self.results = None
+        self.error = None
+        self.finished = False
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        self.resume.acquire()
+        try:
+            self.results = play_game(self.game, predictor=self.predict)
+        except BaseException as error:
+            self.error = error
+        self.finished = True
+        self.paused.release()
+
+    def predict(self, network, features):
+        self.request = (network, features)
+        self.paused.release()
+        self.resume.acquire()
+        if self.stopped:
+            raise RuntimeError("Lockstep game stopped while waiting for a prediction")
+        response = self.response
+        self.request = None
+        self.response = None
+        return response
+
+    def step(self):
+        """
+        Hands control to the game until it asks for a prediction or ends
+        """
+        if not self.thread.is_alive() and not self.finished:
+            self.thread.start()
+        self.resume.release()
+        self.paused.acquire()
+
+    def stop(self):
+        """
+        Ends a game waiting on a prediction by raising an error in its thread
+        """
+        self.stopped = True
+        self.step()
+
+def play_games_lockstep(games):
+    """
+    Plays a list of games (in the format of play_game) side by side. Each step, every game that
+    hasn't ended runs until its next Neural decision, then the decisions waiting on the same
+    network are answered by one batched predict call.
+    Returns the results of the games in order
+    """
+    lockstep_games = [LockstepGame(game) for game in games]
+    active = lockstep_games
+    while len(active) > 0:
+        for lockstep_game in active:
+            lockstep_game.step()
+        active = [lockstep_game for lockstep_game in active if not lockstep_game.finished]
+
+        #Group the waiting games by the network they need, and run one forward pass for each
+        waiting = {}
+        for lockstep_game in active:
+            waiting.setdefault(id(lockstep_game.request[0]), []).append(lockstep_game)
+        try:
+            for network_games in waiting.values():
+                network = network_games[0].request[0]
+                features = np.concatenate([lockstep_game.request[1] for lockstep_game in network_games])
+                scores = playerclasses.predict_points(network, features)
+                start = 0
+                for lockstep_game in network_games:
+                    rows = lockstep_game.request[1].shape[0]
+                    lockstep_game.response = scores[start:start + rows]
+                    start += rows
+        except BaseException:
+            #Let every game waiting on a prediction end instead of leaving its thread parked
+            for lockstep_game in active:
+                lockstep_game.stop()
+            raise
+
+    for lockstep_game in lockstep_games:
+        if lockstep_game.error is not None:
+            raise lockstep_game.error
+    return [lockstep_game.results for lockstep_game in lockstep_games]
+
+def play_array_chunk(chunk):
+    """
+    Plays a chunk of games on the array engine for simulate_games. chunk is a tuple of
+    (seeds, num_players, domino_size, modes)
+    Returns a list of (scores, winner, None, None, None) tuples, one per game, like play_game
+    """
+    seeds, num_players, domino_size, modes = chunk
+    scores, winners = arrayengine.play_array_games(seeds, num_players, domino_size, modes)
+    return [(scores[game_num].tolist(), int(winners[game_num]), None, None, None) for game_num in range(0, len(seeds))]
 
 def simulate_games(num_players=4, domino_size=12, num_games=250, collect_data=True, 
                     debug=False, players=["Random", "Greedy", "Probability", "Neural"], 
-                    file_name="PlayData/data4_12_250"):
+                    file_name="PlayData/data4_12_250", workers=1, chunksize=1, seed=None,
+                    data_format="shards", rows_per_shard=50000, batch_games=1, engine="objects",
+                    stats=None, log_file=None, append=False):
     """
     Runs the mexican train game repeatedly with different combinations of players to
     generate data to be used in testing and training the neural net. 
 
-    If collect_data is on, the play data is retrieved and stored into a .xlsx file for later use
-    The format for the file name for this is as follows:
-    PlayData/data + num_players + _ + domino_size + _ + num_games + .xlsx
-    This spreadsheet is to be used when training the neural net.
+    If collect_data is on, the play data is retrieved and stored for later use in the directory
+    PlayData/data + num_players + _ + domino_size + _ + num_games
+    as a sharded dataset (see datasetclasses.ShardWriter): .npz shards of bit packed one hot
+    blocks and scalar columns plus a manifest.json, with shards written as the games finish.
+    This dataset is to be used when training the neural net.
+    Passing data_format="xlsx" writes the legacy .xlsx spreadsheet of the same name instead.
+    With append on, the shards are added to a dataset already in that directory instead of
+    replacing it (see datasetclasses.ShardWriter), so use a new seed to get new games.
 
     This script has no required parameters, and will run the game with the default params if
     unchanged.
@@ -23,6 +174,33 @@ def simulate_games(num_players=4, domino_size=12, num_games=250, collect_data=Tr
     If collect_data is off, the players are selected in order from the parameter players.
     When collect_data is off: len(players) must equal num_players
 
+    Every game gets its own seed, drawn from a random.Random(seed) stream along with the
+    player selection in collect_data mode, so passing the same seed reproduces a run.
+    With workers greater than 1 the games are spread across a process pool, handing each
+    worker chunksize games at a time. Results are merged back in game order, so a parallel
+    run returns the same scores, wins and data as a serial run with the same seed.
+
+    With batch_games greater than 1, the games are played batch_games at a time in lockstep
+    (see play_games_lockstep), so the Neural players of all those games share one batched
+    predict call per step. Each worker plays its own groups of games this way. Since every
+    game has its own random stream and every prediction is rounded the same way batched or
+    not (see playerclasses.predict_points), a lockstep run plays out the same as a run without
+    batching.
+
+    If a statsclasses.GameStats is passed as stats, every game keeps its own stats (see
+    mtrain.mexicantrain), which are merged into stats as the games come back, from whichever
+    process played them. In lockstep mode a Neural player's decision time includes waiting
+    for the batched prediction.
+
+    If log_file is given, every game keeps an eventclasses.EventLog, and the logs are saved
+    together to log_file in game order (see eventclasses.save_logs). The logs hold everything
+    needed to replay the games, so data can be re-featurized later without playing them again.
+
+    With engine="arrays", Random and Greedy games are played on arrayengine.ArrayGames, each
+    worker playing its share of the games side by side. Every game makes its choices from
+    its own seed, so the scores don't depend on how the games are split between workers.
+    The array engine doesn't collect data or keep stats or logs.
+
     Returns a tuple of lists: (score_averages, win_percentage) corresponding to the players
     """
 
@@ -39,38 +217,99 @@ def simulate_games(num_players=4, domino_size=12, num_games=250, collect_data=Tr
             raise RuntimeError("len(players) must equal num_players when collect_data is off")
         modes = players
 
-    #Simulates num_games of games
-    scores = np.ndarray((num_players, num_games))
-    wins = np.ndarray((num_players, num_games))
-    full_data = pd.DataFrame(columns=column_names)
-    current_index = 0
+    #Shards are built from each game's arrays, the spreadsheet from each game's DataFrame
+    data_name = "PlayData/data" + str(num_players) + "_" + str(domino_size) + "_" + str(num_games)
+    writer = None
+    game_data_format = "dataframe"
+    if collect_data and data_format == "shards":
+        writer = datasetclasses.ShardWriter(data_name, num_players, domino_size, rows_per_shard, append)
+        game_data_format = "arrays"
+
+    #Decide the seed and players of every game up front so the games can run in any process
+    rng = random.Random(seed)
+    games = []
     for game_num in range(0, num_games):
 
         #Randomize players if in collect_data mode
         game_modes = []
         if collect_data:
             for select in range(0, num_players):
-                game_modes.append(random.choice(modes))
+                game_modes.append(rng.choice(modes))
         else:
             game_modes = modes
-        
-        #Run game with parameters
-        results = mtrain.mexicantrain(num_players, domino_size, debug=debug, 
-                                        modes=game_modes, 
-                                        data_collection=collect_data,
-                                        data_index=current_index, file_name=file_name)
-        #If collecting data, data is stored into the dataframe
-        if collect_data:
-            current_index = results[2].index[-1] + 1
-            full_data = pd.concat([full_data, results[2]])
-        
-        #Scores and wins are recorded into their respective arrays
-        for player_num in range(0, num_players):
-            scores[player_num, game_num] = results[0][player_num]
-            if results[1] == player_num:
-                wins[player_num, game_num] = 1
+        games.append((rng.randrange(2**32), num_players, domino_size, game_modes, 
+                      collect_data, debug, file_name, game_data_format, stats is not None,
+                      log_file is not None, None))
+
+    #Simulates num_games of games, in a process pool if there is more than one worker
+    scores = np.ndarray((num_players, num_games))
+    wins = np.ndarray((num_players, num_games))
+    full_data = pd.DataFrame(columns=column_names)
+    current_index = 0
+    if not engine in ["objects", "arrays"]:
+        raise RuntimeError("engine must be objects or arrays, not " + str(engine))
+    if engine == "arrays" and (collect_data or log_file is not None or stats is not None):
+        raise RuntimeError("collect_data must be off and log_file and stats unset when engine is arrays")
+    pool = None
+    logs = []
+    try:
+        if engine == "arrays":
+            chunks = []
+            for start in range(0, workers):
+                chunk_games = games[start::workers]
+                chunks.append(([game[0] for game in chunk_games], num_players, domino_size, modes))
+            if workers > 1:
+                pool = multiprocessing.Pool(workers)
+                chunk_results = pool.map(play_array_chunk, chunks)
+            else:
+                chunk_results = map(play_array_chunk, chunks)
+            all_results = [None] * num_games
+            for start, results in enumerate(chunk_results):
+                all_results[start::workers] = results
+        elif batch_games > 1:
+            groups = [games[start:start + batch_games] for start in range(0, num_games, batch_games)]
+            if workers > 1:
+                pool = multiprocessing.Pool(workers)
+                group_results = pool.imap(play_games_lockstep, groups, chunksize)
             else:
-                wins[player_num, game_num] = 0
+                group_results = map(play_games_lockstep, groups)
+            all_results = itertools.chain.from_iterable(group_results)
+        elif workers > 1:
+            pool = multiprocessing.Pool(workers)
+            all_results = pool.imap(play_game, games, chunksize)
+        else:
+            all_results = map(play_game, games)
+
+        for game_num, results in enumerate(all_results):
+            #If collecting data, data is written to the shards or stored into the dataframe
+            if stats is not None and results[3] is not None:
+                stats.merge(results[3])
+            if results[4] is not None:
+                logs.append(results[4])
+
+            if writer is not None:
+                writer.add(results[2])
+            elif collect_data and results[2].shape[0] > 0:
+                results[2].index = range(current_index, current_index + results[2].shape[0])
+                current_index += results[2].shape[0]
+                full_data = pd.concat([full_data, results[2]])
+            
+            #Scores and wins are recorded into their respective arrays
+            for player_num in range(0, num_players):
+                scores[player_num, game_num] = results[0][player_num]
+                if results[1] == player_num:
+                    wins[player_num, game_num] = 1
+                else:
+                    wins[player_num, game_num] = 0
+    except BaseException:
+        #Stop the workers straight away instead of waiting for every queued game to finish
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
 
     #Calculates performance of the players
     score_averages = np.ndarray((num_players))
@@ -79,12 +318,16 @@ def simulate_games(num_players=4, domino_size=12, num_games=250, collect_data=Tr
         score_averages[player_num] = np.mean(scores[player_num, :])
         win_percentage[player_num] = np.mean(wins[player_num, :])
 
-    #If collecting data, prints data to a .xlsx file
-    if collect_data:
-        filename = "PlayData/data" + str(num_players) + "_" + str(domino_size) + "_" + str(num_games) + ".xlsx"
-        writer = pd.ExcelWriter(filename)
-        full_data.to_excel(writer, "Sheet1")
-        writer.save()
+    if log_file is not None:
+        eventclasses.save_logs(log_file, logs)
+
+    #If collecting data, writes the last shard, or prints data to a .xlsx file
+    if writer is not None:
+        writer.close()
+    elif collect_data:
+        excel_writer = pd.ExcelWriter(data_name + ".xlsx")
+        full_data.to_excel(excel_writer, "Sheet1")
+        excel_writer.save()
 
     #Prints results and returns them as well
     if debug: print(score_averages)
@@ -1,6 +1,10 @@
 import mtrain
 import neuraltrainer
 import mtrainsimulator
+import trainsolver
+import arrayengine
+import benchmarks
+import tournament
 
 if __name__ == "__main__":
     """
@@ -9,7 +13,12 @@ if __name__ == "__main__":
     """
     #results = mtrainsimulator.simulate_games(num_games=100, debug=False)
     #results = mtrainsimulator.simulate_games(debug=False, collect_data=False, num_games=100, file_name="PlayData/data4_12_250")
+    #results = benchmarks.run_benchmarks(num_games=10)
+    #results = tournament.run_tournament(modes=["Greedy", "Probability", "Neural"], workers=4, file_name="PlayData/data3_12_250")
+    #results = arrayengine.compare_engines(num_games=200, num_players=4, domino_size=12)
+    #results = trainsolver.benchmark(num_hands=200, hand_size=16, domino_size=12)
     #results = neuraltrainer.train_neural_net(num_players=4, domino_size=12, file_name="PlayData/data4_12_250", debug=True)
+    #results = neuraltrainer.stream_neural_net("PlayData/data4_12_250", num_players=4, domino_size=12, epochs=20, debug=True)
     results = mtrain.mexicantrain(num_players=4, domino_size=12, data_collection=False, 
                                     debug=False, modes=["Random", "Greedy", "Probability", "Neural"],
                                     file_name="PlayData/data4_12_250")
@@ -1,10 +1,18 @@
+import os
 import pandas as pd
 import numpy as np
 from sklearn.neural_network import MLPRegressor
 import ast
+import dominoclasses
+import datasetclasses
+import playerclasses
 from sklearn.externals import joblib
 
-def train_neural_net(file_name, num_players, domino_size, debug=False, train_size=.6, validation_size=.2, test_size=.2, num_layers=3):
+#The batch size train_neural_net falls back to when the training rows won't fit in memory_limit
+default_batch_rows = 10000
+
+def train_neural_net(file_name, num_players, domino_size, debug=False, train_size=.6, validation_size=.2, test_size=.2, num_layers=3, 
+                     max_iter=500, batch_rows=None, memory_limit=2**30):
     """
     A function to train a neural net on how to play Mexican Train.
     This neural net is a regressor to determine the points gained at the end
@@ -15,16 +23,210 @@ def train_neural_net(file_name, num_players, domino_size, debug=False, train_siz
     The regressor object is stored in a .pkl file after training and testing, and separate
     regressors will need to be trained when using different amounts of players or domino sizes.
     This function should be run after the mtrainsimulator.py file is run, as it requires the data
-    generated into an .xlsx file from this module.
+    generated by this module: either a sharded dataset directory, which is read straight into
+    arrays, or a legacy .xlsx file.
 
     This function takes in the following required parameters:
-    file_name: The path to the .xlsx file without the .xlsx ending
+    file_name: The path to the dataset directory, or to the .xlsx file without the .xlsx ending
     num_players: The number of players the data was generated from
     domino_size: Which size domino the game was played using
 
+    A sharded dataset is trained on through a memory mapped feature matrix (see
+    datasetclasses.load_feature_matrix), and the shuffle and the train/validation/test split
+    are arrays of row indices into it rather than copies of the data. Passing batch_rows
+    trains with partial_fit on batch_rows rows at a time for up to max_iter epochs, so only
+    one batch is in memory at once and datasets bigger than RAM can be trained. Like fit, it
+    stops early once the epoch's mean loss stops improving by the regressor's tol. Left as None, the
+    training rows are copied into memory for a single call to fit if that copy fits in
+    memory_limit bytes (1 GiB by default), and are trained on in batches of
+    default_batch_rows rows otherwise.
+    To train without building the feature matrix at all, see stream_neural_net.
+
     Returns the final score that the trained neural net acquires
     Outputs the Regressor object to a .pkl file
     """
+    if datasetclasses.is_dataset(file_name):
+        #Memory map the feature matrix built from the shards
+        if debug: print("Loading Dataset Feature Matrix...")
+        features, points = datasetclasses.load_feature_matrix(file_name)
+    else:
+        features, points = read_excel_features(file_name, num_players, domino_size, debug)
+    
+    #Randomize the data
+    if debug: print("Randomizing Data Order...")
+    order = np.random.permutation(features.shape[0])
+
+    #Train Neural Network
+    if debug: print("Splitting Data into Training, Validation, and Test sets")
+    train_size = int(train_size * features.shape[0])
+    validation_size = int(validation_size * features.shape[0]) + train_size
+    test_size = int(test_size * features.shape[0]) + validation_size
+
+    train_rows = order[0:train_size]
+    validation_rows = order[train_size+1:validation_size]
+    test_rows = order[validation_size+1:test_size]
+
+    if debug: print("Training Neural Network...")
+    layers = tuple([700 for x in range(0, num_layers)])
+    regressor = MLPRegressor(max_iter=max_iter, activation="relu", hidden_layer_sizes=layers, learning_rate_init=.0015)
+    if batch_rows is None and train_rows.shape[0] * features.shape[1] * features.dtype.itemsize > memory_limit:
+        batch_rows = default_batch_rows
+        if debug: print("Training rows exceed memory_limit, training in batches of " + str(batch_rows) + " rows")
+    if batch_rows is None:
+        #Sorted rows are read from the memory map in file order, fit does its own shuffling
+        fit_rows = np.sort(train_rows)
+        regressor.fit(features[fit_rows], points[fit_rows])
+    else:
+        #Stop on the same rule as fit: once the loss has gone more than n_iter_no_change epochs
+        #(2 before scikit-learn 0.20) without improving on the best by tol
+        patience = getattr(regressor, "n_iter_no_change", 2)
+        best_loss = np.inf
+        no_improvement = 0
+        for epoch in range(0, max_iter):
+            if debug: print("Epoch " + str(epoch))
+            epoch_rows = np.random.permutation(train_rows)
+            epoch_loss = 0.0
+            for start in range(0, epoch_rows.shape[0], batch_rows):
+                batch = np.sort(epoch_rows[start:start + batch_rows])
+                regressor.partial_fit(features[batch], points[batch])
+                epoch_loss += regressor.loss_ * batch.shape[0]
+            epoch_loss /= epoch_rows.shape[0]
+            if epoch_loss > best_loss - regressor.tol:
+                no_improvement += 1
+            else:
+                no_improvement = 0
+            best_loss = min(best_loss, epoch_loss)
+            if no_improvement > patience:
+                if debug: print("Loss stopped improving after " + str(epoch + 1) + " epochs")
+                break
+
+    #Test the network
+    if debug: print("Testing Neural Network")
+    final_score = score_in_batches(regressor, features, points, test_rows, batch_rows)
+    if debug: print("Final Test Score of " + str(final_score))
+    
+    #Store and return the neural network, dropping any stale copy NeuralPlayers have cached
+    joblib.dump(regressor, file_name + ".pkl")
+    playerclasses.model_registry.invalidate(file_name + ".pkl")
+
+    return final_score
+
+def stream_neural_net(file_name, num_players, domino_size, epochs=10, batch_rows=1000, buffer_rows=20000,
+                      test_size=.2, num_layers=3, checkpoint=None, resume=True, seed=0, debug=False):
+    """
+    Trains the same neural net as train_neural_net on a sharded dataset, streaming it from
+    the shards instead of loading it or building its feature matrix.
+
+    Each epoch reads the shards in a random order and featurizes them one at a time, feeding
+    their rows through a shuffle buffer of buffer_rows rows (see datasetclasses.iter_batches)
+    into partial_fit in batches of batch_rows rows, so memory use doesn't grow with the
+    dataset. A test_size share of every shard's rows is held out of training and scored at
+    the end, chosen the same way every run (see datasetclasses.holdout_mask).
+
+    After every epoch the regressor is saved with the number of epochs done to checkpoint,
+    file_name + ".checkpoint.pkl" by default. With resume on, a run starting from an existing
+    checkpoint picks up where it left off and trains until epochs epochs are done, so an
+    interrupted run loses at most an epoch, and calling it again with more epochs once the
+    dataset has gained shards (see the append of mtrainsimulator.simulate_games) folds the new
+    data into the trained net instead of starting over. Appended shards leave the rows held
+    out of the old ones as they were.
+    Each epoch shuffles with its own RandomState seeded from seed and the epoch number, so a
+    resumed run shuffles the same as one that was never stopped. The checkpoint also keeps
+    seed, test_size, batch_rows, buffer_rows and the layer sizes it was trained with, and
+    resuming with any of them changed raises a ValueError, since the held out rows or the
+    shuffle would no longer match; pass resume=False to start over instead.
+
+    Returns the final score of the trained neural net on the held out rows
+    Outputs the Regressor object to a .pkl file
+    """
+    if checkpoint is None:
+        checkpoint = file_name + ".checkpoint.pkl"
+
+    layers = tuple([700 for x in range(0, num_layers)])
+    config = {"seed": seed, "test_size": test_size, "batch_rows": batch_rows, "buffer_rows": buffer_rows,
+              "hidden_layer_sizes": layers}
+    regressor = None
+    first_epoch = 0
+    if resume and os.path.isfile(checkpoint):
+        saved = joblib.load(checkpoint)
+        changed = [key for key in sorted(config) if saved.get("config", {}).get(key) != config[key]]
+        if changed:
+            raise ValueError("Checkpoint " + checkpoint + " was trained with different " + ", ".join(changed) +
+                             ", pass resume=False to start over")
+        regressor = saved["regressor"]
+        first_epoch = saved["epochs"]
+        if debug: print("Resuming from " + checkpoint + " after " + str(first_epoch) + " epochs")
+    if regressor is None:
+        regressor = MLPRegressor(activation="relu", hidden_layer_sizes=layers, learning_rate_init=.0015,
+                                 random_state=seed)
+
+    for epoch in range(first_epoch, epochs):
+        if debug: print("Epoch " + str(epoch))
+        rng = np.random.RandomState((seed * 100003 + epoch) % 2**32)
+        rows = 0
+        for features, points in datasetclasses.iter_batches(file_name, batch_rows, buffer_rows, rng, test_size, seed):
+            regressor.partial_fit(features, points)
+            rows += points.shape[0]
+        if debug: print("Trained on " + str(rows) + " rows, loss " + str(regressor.loss_))
+
+        #Write the checkpoint to a temporary file first so a crash can't leave a broken one
+        joblib.dump({"regressor": regressor, "epochs": epoch + 1, "config": config}, checkpoint + ".tmp")
+        os.replace(checkpoint + ".tmp", checkpoint)
+
+    #Test the network
+    if debug: print("Testing Neural Network")
+    final_score = score_held_out(regressor, file_name, test_size, seed)
+    if debug: print("Final Test Score of " + str(final_score))
+
+    #Store and return the neural network, dropping any stale copy NeuralPlayers have cached
+    joblib.dump(regressor, file_name + ".pkl")
+    playerclasses.model_registry.invalidate(file_name + ".pkl")
+
+    return final_score
+
+def score_held_out(regressor, file_name, test_size, seed=0):
+    """
+    Returns the R^2 score of the regressor on the rows of a sharded dataset held out by
+    stream_neural_net, reading one shard at a time
+    """
+    rows = 0
+    residual = 0.0
+    total = 0.0
+    squares = 0.0
+    for features, points in datasetclasses.iter_feature_shards(file_name, None, test_size, True, seed):
+        if points.shape[0] == 0:
+            continue
+        actual = np.asarray(points, dtype=np.float64)
+        residual += np.sum((actual - regressor.predict(features)) ** 2)
+        rows += actual.shape[0]
+        total += np.sum(actual)
+        squares += np.sum(actual ** 2)
+    if rows == 0:
+        return float("nan")
+    return 1 - residual / (squares - total * total / rows)
+
+def score_in_batches(regressor, features, points, rows, batch_rows=None):
+    """
+    Returns the R^2 score of the regressor on the given rows, predicting batch_rows rows at a
+    time so the rows never have to be copied out of the feature matrix all at once
+    """
+    rows = np.sort(rows)
+    if batch_rows is None:
+        batch_rows = max(rows.shape[0], 1)
+    predictions = np.zeros(rows.shape[0])
+    for start in range(0, rows.shape[0], batch_rows):
+        batch = rows[start:start + batch_rows]
+        predictions[start:start + batch.shape[0]] = regressor.predict(features[batch])
+    actual = np.asarray(points[rows], dtype=np.float64)
+    residual = np.sum((actual - predictions) ** 2)
+    total = np.sum((actual - np.mean(actual)) ** 2)
+    return 1 - residual / total
+
+def read_excel_features(file_name, num_players, domino_size, debug=False):
+    """
+    Reads a legacy .xlsx spreadsheet of play data and builds the neural net features from it
+    Returns the feature matrix and the points column
+    """
     #Set up numerical and categorical features
     numerical_features = ["round_number", "turn_number", "points", "t_num"]
     vector_features = ["play", "hand", "unknown", "potential_plays"]
@@ -45,10 +247,6 @@ def train_neural_net(file_name, num_players, domino_size, debug=False, train_siz
         except ValueError:
             print(col)
             raise ValueError
-    
-    #Randomize the data
-    if debug: print("Randomizing Data Order...")
-    full_data = full_data.reindex(np.random.permutation(full_data.index))
 
     #Turn categorical data into hundreds of features
     if debug: print("Building Usable Dataframe...")
@@ -58,39 +256,17 @@ def train_neural_net(file_name, num_players, domino_size, debug=False, train_siz
     true_data["points"] = full_data["points"]
     true_data["t_num"] = full_data["t_num"]
 
-    domino_count = int(domino_size + 1 + ((domino_size + 1) * domino_size) / 2.0)
-    for current in range(0, domino_count):
-            true_data["play_" + str(current)] = [x[current] for x in full_data["play"]]
-            true_data["hand_" + str(current)] = [x[current] for x in full_data["hand"]]
-            true_data["unknown_" + str(current)] = [x[current] for x in full_data["unknown"]]
-            true_data["potential_plays_" + str(current)] = [x[current] for x in full_data["potential_plays"]]
+    encoder = dominoclasses.domino_table(domino_size)
+    blocks = {}
+    for col in vector_features:
+        blocks[col] = np.array(list(full_data[col]), dtype=np.uint8)
+    for current in range(0, encoder.count):
+        for col in ["play", "hand", "unknown", "potential_plays"]:
+            true_data[col + "_" + str(current)] = blocks[col][:, current]
     
     for num in range(0, num_players + 1):
         true_data["marker_" + str(num)] = full_data["marker_" + str(num)]
-        for current in range(0, domino_count):
-            true_data["train_" + str(num) + "_" + str(current)] = [x[current] for x in full_data["train_" + str(num)]]
-
-    #Train Neural Network
-    if debug: print("Splitting Data into Training, Validation, and Test sets")
-    train_size = int(train_size * true_data.shape[0])
-    validation_size = int(validation_size * true_data.shape[0]) + train_size
-    test_size = int(test_size * true_data.shape[0]) + validation_size
-
-    train_data = true_data.iloc[0:train_size, :]
-    validation_data = true_data.iloc[train_size+1:validation_size, :]
-    test_data = true_data.iloc[validation_size+1:test_size, :]
-
-    if debug: print("Training Neural Network...")
-    layers = tuple([700 for x in range(0, num_layers)])
-    regressor = MLPRegressor(max_iter=500, activation="relu", hidden_layer_sizes=layers, learning_rate_init=.0015)
-    regressor.fit(train_data.drop(["points"], axis=1), train_data["points"])
-
-    #Test the network
-    if debug: print("Testing Neural Network")
-    final_score = regressor.score(test_data.drop(["points"], axis=1), test_data["points"])
-    if debug: print("Final Test Score of " + str(final_score))
-    
-    #Store and return the neural network
-    joblib.dump(regressor, file_name + ".pkl")
+        for current in range(0, encoder.count):
+            true_data["train_" + str(num) + "_" + str(current)] = blocks["train_" + str(num)][:, current]
 
-    return final_score
\ No newline at end of file
+    return true_data.drop(["points"], axis=1).values, true_data["points"].values
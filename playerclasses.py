@@ -1,18 +1,159 @@
 from abc import ABC, abstractmethod
 import treeclasses
+import trainsolver
 import random
 import copy
+import os
 from sklearn.externals import joblib
 from sklearn.neural_network import MLPRegressor
-import pandas
-import mtrain
+import dominoclasses
+import stateclasses
+import numpy as np
+
+class ModelRegistry:
+    """
+    Loads each neural net .pkl file once per process and hands the same regressor to every
+    NeuralPlayer that asks for it, instead of unpickling it again for every player in every game.
+
+    Models are keyed on the absolute path of the file and its modification time, so a file that
+    has been rewritten is loaded again. hits and misses count how often a load was served from
+    the cache or had to read the file.
+    """
+
+    def __init__(self):
+        self.models = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, filename):
+        path = os.path.abspath(filename)
+        mtime = os.path.getmtime(path)
+        entry = self.models.get(path)
+        if entry is not None and entry[0] == mtime:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        model = joblib.load(path)
+        self.models[path] = (mtime, model)
+        return model
+
+    def invalidate(self, filename=None):
+        """
+        Drops the cached model for filename, or every cached model if no filename is given
+        """
+        if filename is None:
+            self.models = {}
+        else:
+            self.models.pop(os.path.abspath(filename), None)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "models": len(self.models)}
+
+#The registry shared by every NeuralPlayer in the process
+model_registry = ModelRegistry()
+
+#Decimal places predicted points are rounded to. A batched forward pass can differ from a
+#single one by a few millionths, so rounding both keeps the choice of play the same either way
+prediction_decimals = 3
+
+def predict_points(network, features):
+    """
+    Returns the network's predicted end of round points for each row of features, rounded to
+    prediction_decimals places. Every prediction, batched or not, should go through this
+    """
+    return np.round(network.predict(features), prediction_decimals)
+
+class KnowledgeTracker:
+    """
+    Keeps track of the dominos a player hasn't seen yet this round: everything except its own
+    hand, the round's double and the dominos played on trains.
+
+    The engine keeps it up to date through the player's start_round, drew and saw_play
+    methods. The unknown dominos are held as a bitmask over the DominoTable index together
+    with a count of unknown dominos for each pip, so the chance that an unknown domino has a
+    given pip is a single division per pip.
+    """
+
+    def __init__(self, domino_size):
+        self.table = dominoclasses.domino_table(domino_size)
+        self.unknown = 0
+        self.total = 0
+        self.pip_counts = [0 for x in range(0, domino_size + 1)]
+        self.active = False
+
+    def start_round(self, round_number, dominos):
+        self.unknown = self.table.full_mask & ~self.table.mask_of(dominos) & ~self.table.double_masks[round_number]
+        self.total = bin(self.unknown).count("1")
+        for value in range(0, len(self.pip_counts)):
+            self.pip_counts[value] = bin(self.unknown & self.table.pip_masks[value]).count("1")
+        self.active = True
+
+    def remove(self, dominos):
+        """
+        Marks dominos as seen, either because they were played or drawn by the player
+        """
+        for domino in dominos:
+            if domino[0] < 0:
+                continue
+            location = self.table.index[domino]
+            if not self.unknown & (1 << location):
+                continue
+            self.unknown ^= 1 << location
+            self.total -= 1
+            seen = self.table.dominos[location]
+            self.pip_counts[seen[0]] -= 1
+            if seen[1] != seen[0]:
+                self.pip_counts[seen[1]] -= 1
+
+    def unknown_dominos(self):
+        return self.table.dominos_in(self.unknown)
+
+    def playability_probabilities(self):
+        """
+        Returns, for each pip, the chance that an unknown domino has that pip on it
+        """
+        if self.total == 0:
+            return [0.0 for count in self.pip_counts]
+        return [count / float(self.total) for count in self.pip_counts]
 
 class Player(ABC):
 
+    #Players that look ahead set this to get a GameState at the start of each of their turns
+    needs_state = False
+
     def __init__(self, player_num):
         self.player_num = player_num
+        self.knowledge = None
         super().__init__()
 
+    def start_round(self, round_number, dominos):
+        """
+        Called by the engine once the hands are dealt and the round's double has been placed
+        """
+        if self.knowledge is not None:
+            self.knowledge.start_round(round_number, dominos)
+
+    def drew(self, dominos):
+        """
+        Called by the engine with the dominos this player drew during the round
+        """
+        if self.knowledge is not None:
+            self.knowledge.remove(dominos)
+
+    def saw_play(self, dominos):
+        """
+        Called by the engine with the dominos any player put on a train
+        """
+        if self.knowledge is not None:
+            self.knowledge.remove(dominos)
+
+    def see_state(self, state):
+        """
+        Called by the engine at the start of this player's turn with a stateclasses.GameState
+        of the game, if needs_state is set
+        """
+        pass
+
     @abstractmethod
     def play_train(self, dominos, start_value):
         pass
@@ -25,13 +166,24 @@ class Player(ABC):
     def play_normally(self, dominos, trains, round_number, turn_number):
         pass
 
+    def pip_index(self, dominos):
+        """
+        Returns the pip index of dominos: the one carried by a hand's DominoList, or a new one
+        """
+        by_pip = getattr(dominos, "by_pip", None)
+        if by_pip is None:
+            by_pip = dominoclasses.pip_index(dominos)
+        return by_pip
+
     def can_play_on_single(self, dominos, targets):
         """
         Checks to find all possible single domino plays that can play on the available targets
+        Only the dominos sharing the target's open pip are looked at, in hand order
         """
+        by_pip = self.pip_index(dominos)
         potential_plays = []
         for target in targets:
-            for domino in dominos:
+            for domino in by_pip.get(target[1], ()):
                 if domino[0] == domino[1]:
                     continue
                 else:
@@ -45,12 +197,15 @@ class Player(ABC):
     def can_play_on_double_good(self, dominos, targets):
         """
         Checks to find all possible good double pair dominos that can play on the available targets
+        Only the dominos sharing the target's open pip are looked at, in hand order
         """
+        by_pip = self.pip_index(dominos)
         potential_plays = []
         for target in targets:
-            for domino1 in dominos:
-                if domino1[0] == domino1[1] and domino1[0] == target[1]:
-                    for domino2 in dominos:
+            matches = by_pip.get(target[1], ())
+            for domino1 in matches:
+                if domino1[0] == domino1[1]:
+                    for domino2 in matches:
                         if domino1[0] == domino2[0] and domino1[1] == domino2[1]:
                             continue
                         elif domino1[0] == domino2[0]:
@@ -67,11 +222,13 @@ class Player(ABC):
     def can_play_on_double_bad(self, dominos, targets):
         """
         Checks to find all possible bad double pair dominos that can play on the available targets
+        Only the dominos sharing the target's open pip are looked at, in hand order
         """
+        by_pip = self.pip_index(dominos)
         potential_plays = []
         for target in targets:
-            for domino in dominos:
-                if domino[0] == domino[1] and domino[0] == target[1]:
+            for domino in by_pip.get(target[1], ()):
+                if domino[0] == domino[1]:
                     potential_plays.append((target, domino))
                 else:
                     continue   
@@ -126,12 +283,7 @@ class GreedyPlayer(Player):
         """
         Returns a list of the longest possible series of dominos to play
         """
-        nd = self.build_network(dominos, start_value, [])
-        path = self.find_longest_path(nd, [])
-        train = []
-        for x in range(0, len(path) - 1):
-            train.append((path[x], path[x+1]))
-        return train
+        return trainsolver.train_cache.longest_train(dominos, start_value)
 
     def play_forced_double(self, dominos, train):
         """
@@ -218,16 +370,17 @@ class GreedyPlayer(Player):
         return t_num, plays, potential_plays
 
 class RandomPlayer(Player):
+
+    def __init__(self, player_num, rng=None):
+        super().__init__(player_num)
+        #The random.Random the player chooses its plays with, or the random module
+        self.rng = rng if rng is not None else random
+
     def play_train(self, dominos, start_value):
         """
         Returns a list of the longest possible series of dominos to play
         """
-        nd = self.build_network(dominos, start_value, [])
-        path = self.find_longest_path(nd, [])
-        train = []
-        for x in range(0, len(path) - 1):
-            train.append((path[x], path[x+1]))
-        return train
+        return trainsolver.train_cache.longest_train(dominos, start_value)
 
     def play_forced_double(self, dominos, train):
         """
@@ -241,7 +394,7 @@ class RandomPlayer(Player):
             play_data = []
             for play in plays:
                 play_data.append(play[1])
-            index = random.randrange(0, len(plays))
+            index = self.rng.randrange(0, len(plays))
             return [plays[index][1]], play_data
 
     def play_normally(self, dominos, trains, round_number, turn_number):
@@ -273,7 +426,7 @@ class RandomPlayer(Player):
                 continue
             else:
                 x_index = x
-                y_index = random.randrange(0, len(potential_plays[x]))
+                y_index = self.rng.randrange(0, len(potential_plays[x]))
 
         if x_index == -1 or y_index == -1:
             return -1, [], []
@@ -300,8 +453,11 @@ class ProbabilityPlayer(Player):
     def __init__(self, player_num, domino_size):
         super().__init__(player_num)
         self.domino_size = domino_size
+        self.knowledge = KnowledgeTracker(domino_size)
 
     def get_unknown_dominos(self, trains, dominos, round_number):
+        if self.knowledge.active:
+            return self.knowledge.unknown_dominos()
         known_dominos = copy.deepcopy(dominos)
         known_dominos += [(round_number, round_number)]
         for train in trains:
@@ -325,16 +481,70 @@ class ProbabilityPlayer(Player):
             play_probs.append(prob)
         return play_probs
 
+    def score_plays(self, dominos, targets, potential_plays, playability_probabilities):
+        """
+        Scores every potential play in all three categories at once. A play's combined score is
+        half its pip total (scaled by the largest domino) and half the chance that no unknown
+        domino matches the pip it leaves open, counted only if the player could play again
+        afterwards: that is, if any non-double left in the hand matches one of the open pips
+        (the other targets plus the newly opened one).
+
+        The follow up check is done on pip count vectors: the count of non-doubles in the hand
+        for each pip, less the non-double each play uses (a play never uses more than one).
+        Returns an array of the combined scores, in the order of potential_plays flattened
+        """
+        num_pips = self.domino_size + 1
+        plays = potential_plays[0] + potential_plays[1] + potential_plays[2]
+        if len(plays) == 0:
+            return np.zeros(0)
+
+        #Non-double count per pip for the whole hand
+        hand = set(dominos)
+        hand_counts = np.zeros(num_pips, dtype=np.int64)
+        for domino in dominos:
+            if domino[0] != domino[1]:
+                hand_counts[domino[0]] += 1
+                hand_counts[domino[1]] += 1
+
+        #The dominos each play takes out of the hand, the pip it opens and its pip total
+        used_rows = []
+        used_pips = []
+        open_pips = []
+        scores = []
+        for row in range(0, len(plays)):
+            play = plays[row]
+            for domino in play[1:]:
+                if domino[0] != domino[1] and domino in hand:
+                    used_rows += [row, row]
+                    used_pips += [domino[0], domino[1]]
+            open_pips.append(play[-1][1])
+            scores.append(sum([domino[0] + domino[1] for domino in play[1:]]))
+        remaining_counts = np.repeat(hand_counts[np.newaxis, :], len(plays), axis=0)
+        remaining_counts[used_rows, used_pips] -= 1
+
+        #Open pips after each play: every target other than the one played on, plus the new end
+        target_ids = {}
+        for target in targets:
+            target_ids.setdefault(target, len(target_ids))
+        target_rows = np.array([target_ids[target] for target in targets])
+        target_pips = np.zeros((len(targets), num_pips), dtype=np.int64)
+        target_pips[np.arange(len(targets)), [target[1] for target in targets]] = 1
+        play_targets = np.array([target_ids[play[0]] for play in plays])
+        other_targets = play_targets[:, np.newaxis] != target_rows[np.newaxis, :]
+        open_mask = np.dot(other_targets.astype(np.int64), target_pips) > 0
+        open_mask[np.arange(len(plays)), open_pips] = True
+
+        play_off_score = np.any(open_mask & (remaining_counts > 0), axis=1).astype(np.float64)
+        probs = np.array(playability_probabilities, dtype=np.float64)[open_pips]
+        combined_score = .5 * np.array(scores, dtype=np.float64) / (self.domino_size * 2)
+        combined_score += .5 * (1 - probs) * play_off_score
+        return combined_score
+
     def play_train(self, dominos, start_value):
         """
         Returns a list of the longest possible series of dominos to play
         """
-        nd = self.build_network(dominos, start_value, [])
-        path = self.find_longest_path(nd, [])
-        train = []
-        for x in range(0, len(path) - 1):
-            train.append((path[x], path[x+1]))
-        return train
+        return trainsolver.train_cache.longest_train(dominos, start_value)
 
     def play_forced_double(self, dominos, train):
         """
@@ -375,81 +585,30 @@ class ProbabilityPlayer(Player):
 
         targets.append(trains[self.player_num].get_last())
 
-        scores = [[],[],[]]
-        probs = [[],[],[]]
-        play_off_score = [[],[],[]]
         potential_plays = [[],[],[]]
 
         potential_plays[0] = self.can_play_on_single(dominos, targets)
         potential_plays[1] = self.can_play_on_double_good(dominos, targets)
         potential_plays[2] = self.can_play_on_double_bad(dominos, targets)
 
-        unknown_dominos = self.get_unknown_dominos(trains, dominos, round_number)
-        playability_probabilities = self.playability_probabilities(unknown_dominos)
-
-        for play in potential_plays[0]:
-            scores[0].append(play[1][0] + play[1][1])
-            try:
-                probs[0].append(playability_probabilities[play[1][1]])
-            except TypeError:
-                print("Play: " + str(play))
-                print("Targets: " + str(targets))
-                print("Dominos: " + str(dominos))
-                print("Dominos size: " + str(len(dominos)))
-                print("Playernum: " + str(self.player_num))
-                raise TypeError("Issue")
-            
-            doms = [dom for dom in dominos if not dom == play[1]]
-            targs = [tar for tar in targets if not tar == play[0]]
-            targs += [play[1]]
-            if len(self.can_play_on_single(doms, targs)) > 0 \
-                    or len(self.can_play_on_double_good(doms, targs)) > 0:
-                play_off_score[0].append(1)
-            else:
-                play_off_score[0].append(0)
-        
-        for play in potential_plays[1]:
-            scores[1].append(play[1][0] + play[1][1] + play[2][0] + play[2][1])
-            probs[1].append(playability_probabilities[play[2][1]])
-
-            doms = [dom for dom in dominos if not dom == play[1] and not dom == play[2]]
-            targs = [tar for tar in targets if not tar == play[0]]
-            targs += [play[2]]
-            if len(self.can_play_on_single(doms, targs)) > 0 \
-                    or len(self.can_play_on_double_good(doms, targs)) > 0:
-                play_off_score[1].append(1)
-            else:
-                play_off_score[1].append(0)
-        
-        for play in potential_plays[2]:
-            scores[2].append(play[1][0] + play[1][1])
-            probs[2].append(playability_probabilities[play[1][1]])
-
-            doms = [dom for dom in dominos if not dom == play[1]]
-            targs = [tar for tar in targets if not tar == play[0]]
-            targs += [play[1]]
-            if len(self.can_play_on_single(doms, targs)) > 0 \
-                    or len(self.can_play_on_double_good(doms, targs)) > 0:
-                play_off_score[2].append(1)
-            else:
-                play_off_score[2].append(0)
-        
-        combined_score = [[0 for x in scores[0]],[0 for x in scores[1]],[0 for x in scores[2]]]
-        for x in range(0, 3):
-            for y in range(0, len(scores[x])):
-                combined_score[x][y] = .5 * scores[x][y] / (self.domino_size * 2)
-                combined_score[x][y] += .5 * (1 - probs[x][y]) * play_off_score[x][y]
+        if self.knowledge.active:
+            playability_probabilities = self.knowledge.playability_probabilities()
+        else:
+            unknown_dominos = self.get_unknown_dominos(trains, dominos, round_number)
+            playability_probabilities = self.playability_probabilities(unknown_dominos)
 
-        max_net_score = -1
+        #Pick the best scoring play, the first one found winning any ties
+        combined_score = self.score_plays(dominos, targets, potential_plays, playability_probabilities)
         x_index = -1
         y_index = -1
-
-        for x in range(0, 3):
-            for y in range(0, len(combined_score[x])):
-                if combined_score[x][y] > max_net_score:
-                    max_net_score = combined_score[x][y]
+        if combined_score.shape[0] > 0:
+            best = int(np.argmax(combined_score))
+            for x in range(0, 3):
+                if best < len(potential_plays[x]):
                     x_index = x
-                    y_index = y
+                    y_index = best
+                    break
+                best -= len(potential_plays[x])
 
         if x_index == -1 or y_index == -1:
             return -1, [], []
@@ -470,25 +629,35 @@ class ProbabilityPlayer(Player):
         return t_num, plays, potential_plays
 
 class NeuralPlayer(Player):
-    def __init__(self, player_num, domino_size, filename, num_players):
+    """
+    A player that scores each potential play with a trained neural net and picks the play
+    predicted to leave it with the fewest points at the end of the round.
+
+    If a predictor is given, it is called as predictor(network, features) instead of
+    predict_points(network, features), which lets many games share one batched forward pass.
+    """
+
+    def __init__(self, player_num, domino_size, filename, num_players, predictor=None):
         super().__init__(player_num)
+        self.predictor = predictor
         self.num_players = num_players
         self.domino_size = domino_size
-        self.network = joblib.load(filename + ".pkl")
-        self.features = ["round_number", "turn_number", "t_num"]
-        self.features += ["play", "hand", "unknown", "potential_plays"]
-        for num in range(0, num_players + 1):
-            self.features.append("train_" + str(num))
-            self.features.append("marker_" + str(num))
-        
-    
+        self.encoder = dominoclasses.domino_table(domino_size)
+        self.knowledge = KnowledgeTracker(domino_size)
+        self.network = model_registry.load(filename + ".pkl")
+        self.feature_count = 3 + 4 * self.encoder.count + (num_players + 1) * (self.encoder.count + 1)
+
     def predict_scores_of_plays(self, play_data):
         if play_data.shape[0] < 1:
             return []
-        scores = self.network.predict(play_data)
+        if self.predictor is not None:
+            return self.predictor(self.network, play_data)
+        scores = predict_points(self.network, play_data)
         return scores
     
     def get_unknown_dominos(self, trains, dominos, round_number):
+        if self.knowledge.active:
+            return self.knowledge.unknown_dominos()
         known_dominos = copy.deepcopy(dominos)
         known_dominos += [(round_number, round_number)]
         for train in trains:
@@ -500,65 +669,61 @@ class NeuralPlayer(Player):
                     unknown_dominos.append((x,y))
         return unknown_dominos
     
-    def build_dataframe(self, round_number, turn_number, trains, dominos, potential_plays):
-        first_frame = pandas.DataFrame(columns=self.features)
-        for x in range(0, len(potential_plays)):
-            first_frame.loc[x, "round_number"] = round_number
-            first_frame.loc[x, "turn_number"] = turn_number
-
-            plays = [potential_plays[y][1] for y in range(0, len(potential_plays))]
-            first_frame.loc[x, "potential_plays"] = mtrain.create_one_hot(self.domino_size, plays)
-
-            unknown = self.get_unknown_dominos(trains, dominos, round_number)
-            first_frame.loc[x, "unknown"] = mtrain.create_one_hot(self.domino_size, unknown)
-
-            first_frame.loc[x, "hand"] = mtrain.create_one_hot(self.domino_size, dominos)
-            
+    def build_features(self, round_number, turn_number, trains, dominos, potential_plays):
+        """
+        Builds the neural net features of every potential play, in the column order of
+        datasetclasses.feature_names. The features describing the state of the game are built
+        once as a single row, then broadcast to one row per play with only the play and t_num
+        columns changed. Returns a float32 matrix with a row for each play
+        """
+        count = self.encoder.count
+        state = np.zeros(self.feature_count, dtype=np.float32)
+        state[0] = round_number
+        state[1] = turn_number / self.num_players
+
+        #The play, hand, unknown and potential_plays one hots are interleaved per domino
+        vectors = state[3:3 + 4 * count].reshape(count, 4)
+        vectors[:, 1] = self.encoder.encode(dominos)
+        if self.knowledge.active:
+            vectors[:, 2] = self.encoder.encode_mask(self.knowledge.unknown)
+        else:
+            known_dominos = list(dominos) + [(round_number, round_number)]
+            for train in trains:
+                known_dominos += train.train_list
+            vectors[:, 2] = 1 - self.encoder.encode(known_dominos)
+        vectors[:, 3] = self.encoder.encode([play[1] for play in potential_plays])
+
+        #Each train is its marker followed by its one hot
+        train_block = state[3 + 4 * count:].reshape(len(trains), count + 1)
+        for train_num in range(0, len(trains)):
+            if trains[train_num].marker_up:
+                train_block[train_num, 0] = 1
+            train_block[train_num, 1:] = self.encoder.encode(trains[train_num].train_list)
+
+        t_nums = []
+        play_columns = []
+        for play in potential_plays:
+            t_num = -1
             for train_num in range(0, len(trains)):
-                first_frame.loc[x, "train_" + str(train_num)] = mtrain.create_one_hot(self.domino_size, trains[train_num].train_list)
-                if trains[train_num].marker_up:
-                    first_frame.loc[x, "marker_" + str(train_num)] = 1
-                else:
-                    first_frame.loc[x, "marker_" + str(train_num)] = 0
-                
                 if trains[train_num].marker_up or train_num == self.player_num:
                     target = trains[train_num].get_last()
-                    if target == (-1, -1) and potential_plays[x][0] == (round_number, round_number):
-                        first_frame.loc[x, "t_num"] = train_num
-                    elif target == potential_plays[x][0]:
-                        first_frame.loc[x, "t_num"] = train_num
-                
-            first_frame.loc[x, "play"] = mtrain.create_one_hot(self.domino_size,[potential_plays[x][1]])
-        
-        true_data = pandas.DataFrame()
-        true_data["round_number"] = first_frame["round_number"]
-        true_data["turn_number"] = first_frame["turn_number"]
-        true_data["t_num"] = first_frame["t_num"]
-
-        domino_count = int(self.domino_size + 1 + ((self.domino_size + 1) * self.domino_size) / 2.0)
-        for current in range(0, domino_count):
-                true_data["play_" + str(current)] = [x[current] for x in first_frame["play"]]
-                true_data["hand_" + str(current)] = [x[current] for x in first_frame["hand"]]
-                true_data["unknown_" + str(current)] = [x[current] for x in first_frame["unknown"]]
-                true_data["potential_plays_" + str(current)] = [x[current] for x in first_frame["potential_plays"]]
-        
-        for num in range(0, self.num_players + 1):
-            true_data["marker_" + str(num)] = first_frame["marker_" + str(num)]
-            for current in range(0, domino_count):
-                true_data["train_" + str(num) + "_" + str(current)] = [x[current] for x in first_frame["train_" + str(num)]]
-        
-        return true_data
+                    if target == (-1, -1) and play[0] == (round_number, round_number):
+                        t_num = train_num
+                    elif target == play[0]:
+                        t_num = train_num
+            t_nums.append(t_num)
+            play_columns.append(3 + 4 * self.encoder.index[play[1]])
+
+        candidates = np.repeat(state[np.newaxis, :], len(potential_plays), axis=0)
+        candidates[:, 2] = t_nums
+        candidates[np.arange(len(potential_plays)), play_columns] = 1
+        return candidates
 
     def play_train(self, dominos, start_value):
         """
         Returns a list of the longest possible series of dominos to play
         """
-        nd = self.build_network(dominos, start_value, [])
-        path = self.find_longest_path(nd, [])
-        train = []
-        for x in range(0, len(path) - 1):
-            train.append((path[x], path[x+1]))
-        return train
+        return trainsolver.train_cache.longest_train(dominos, start_value)
 
     def play_forced_double(self, dominos, train):
         """
@@ -612,7 +777,7 @@ class NeuralPlayer(Player):
             formatted_plays.append((play[0], play[-1]))
         
         try:
-            data = self.build_dataframe(round_number, turn_number, trains, dominos, formatted_plays)
+            data = self.build_features(round_number, turn_number, trains, dominos, formatted_plays)
             scores = self.predict_scores_of_plays(data)
         except ValueError:
             print("Round: " + str(round_number))
@@ -623,7 +788,6 @@ class NeuralPlayer(Player):
                 print("Dominos: " + str(dom))
             for pl in formatted_plays:
                 print("Plays: " + str(pl))
-            print(data.head())
             raise ValueError
             
 
@@ -652,4 +816,89 @@ class NeuralPlayer(Player):
                 elif target == train.get_last():
                     t_num = x
 
-        return t_num, plays, potential_plays
\ No newline at end of file
+        return t_num, plays, potential_plays
+
+class RolloutPlayer(GreedyPlayer):
+    """
+    A player that picks its normal plays by determinized rollouts: rollouts times, everything
+    it can't see is dealt out again at random (see stateclasses.GameState.determinize), and
+    every play it has is tried in that deal and played out to the end of the round with every
+    player following policy. The play that leaves it the fewest points against the average of
+    the other players, summed over the deals, is chosen. Trying every play on the same deals
+    keeps the luck of the deal from deciding between them.
+
+    The opening train and covering a double have few choices and are played like GreedyPlayer.
+    rng is the random.Random the deals and policy draw from, or the random module
+
+    A decision runs rollouts times the number of plays it has. The default of 50 deals comes
+    to a few hundred rollouts a decision rather than thousands: about 220 and 30 ms in 4 player
+    double-12 games against Greedy (see benchmarks.bench_rollouts), which keeps a game with
+    Rollout seats to a couple of seconds. Raise rollouts when strength matters more than speed
+    """
+
+    needs_state = True
+
+    def __init__(self, player_num, rollouts=50, rng=None, policy=stateclasses.greedy_move):
+        super().__init__(player_num)
+        self.rollouts = rollouts
+        self.rng = rng if rng is not None else random
+        self.policy = policy
+        self.state = None
+
+    def see_state(self, state):
+        self.state = state
+
+    def evaluate_moves(self, state, moves, dominos):
+        """
+        Returns the summed rollout outcome of each move, lower being better
+        """
+        totals = [0.0 for move in moves]
+        others = state.num_players - 1
+        drawn = len(dominos) > bin(state.hands[self.player_num]).count("1")
+        for deal in range(0, self.rollouts):
+            world = state.determinize(self.player_num, self.rng, dominos)
+            world.drawn = drawn
+            for move_num in range(0, len(moves)):
+                simulation = world.clone()
+                simulation.step(moves[move_num])
+                scores = stateclasses.rollout(simulation, self.policy, self.rng)
+                own = scores[self.player_num]
+                totals[move_num] += own - (sum(scores) - own) / float(others)
+        return totals
+
+    def play_normally(self, dominos, trains, round_number, turn_number):
+        """
+        Returns the train to play on, the dominos to play and the potential plays, choosing
+        the play with the best rollouts
+        """
+        if self.state is None:
+            return super().play_normally(dominos, trains, round_number, turn_number)
+
+        targets = []
+        for x in range(0, len(trains)):
+            train = trains[x]
+            if train.marker_up:
+                if train.get_last() == (-1, -1):
+                    targets.append((round_number, round_number))
+                else:
+                    targets.append(train.get_last())
+        targets.append(trains[self.player_num].get_last())
+
+        potential_plays = [[],[],[]]
+        potential_plays[0] = self.can_play_on_single(dominos, targets)
+        potential_plays[1] = self.can_play_on_double_good(dominos, targets)
+        potential_plays[2] = self.can_play_on_double_bad(dominos, targets)
+
+        state = self.state.clone()
+        state.hands[self.player_num] = state.table.mask_of(dominos)
+        moves = state.moves()
+        if len(moves) == 0:
+            return -1, [], []
+        best = 0
+        if len(moves) > 1:
+            totals = self.evaluate_moves(self.state, moves, dominos)
+            for move_num in range(1, len(moves)):
+                if totals[move_num] < totals[best]:
+                    best = move_num
+        t_num, plays = moves[best]
+        return t_num, list(plays), potential_plays
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+import dominoclasses
+
+class RowRecorder:
+    """
+    Collects the play data rows of a game in data_collection mode.
+
+    Every feature block is a preallocated NumPy array (uint8 one hot matrices for the play,
+    hand, unknown dominos, potential plays and each train, plus scalar columns), and rows
+    are written straight into them. The arrays double in size when they fill up. Nothing is
+    turned into a DataFrame until the game ends and to_dataframe or to_arrays is called.
+
+    Rows are grouped by round: end_round fills the points of the round that just finished
+    and records its row range in round_ranges as (round_number, first_row, last_row + 1).
+    """
+
+    def __init__(self, num_players, domino_size, capacity=256):
+        self.num_players = num_players
+        self.num_trains = num_players + 1
+        self.encoder = dominoclasses.domino_table(domino_size)
+        self.size = 0
+        self.capacity = 0
+        self.round_start = 0
+        self.round_ranges = []
+        self.round_number = np.zeros(0, dtype=np.int16)
+        self.turn_number = np.zeros(0, dtype=np.float64)
+        self.player_number = np.zeros(0, dtype=np.int8)
+        self.t_num = np.zeros(0, dtype=np.int8)
+        self.points = np.zeros(0, dtype=np.int32)
+        self.markers = np.zeros((0, self.num_trains), dtype=np.uint8)
+        self.play = np.zeros((0, self.encoder.count), dtype=np.uint8)
+        self.hand = np.zeros((0, self.encoder.count), dtype=np.uint8)
+        self.unknown = np.zeros((0, self.encoder.count), dtype=np.uint8)
+        self.potential_plays = np.zeros((0, self.encoder.count), dtype=np.uint8)
+        self.trains = np.zeros((0, self.num_trains, self.encoder.count), dtype=np.uint8)
+        self.grow(capacity)
+
+    def grow(self, capacity):
+        """
+        Reallocates every block to hold capacity rows, keeping the rows recorded so far
+        """
+        for name in ["round_number", "turn_number", "player_number", "t_num", "points",
+                     "markers", "play", "hand", "unknown", "potential_plays", "trains"]:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[0:self.size] = old[0:self.size]
+            setattr(self, name, new)
+        self.capacity = capacity
+
+    def set_dominos(self, block, row, dominos):
+        for domino in dominos:
+            if domino[0] < 0:
+                continue
+            block[row, self.encoder.index[domino]] = 1
+
+    def record(self, round_number, turn_number, player_number, play, t_num, hand, unknown,
+               potential_plays, trains):
+        """
+        Records a single play. play, hand, unknown and potential_plays are lists of dominos,
+        and trains is the list of Train objects at the time of the play
+        """
+        if self.size == self.capacity:
+            self.grow(max(self.capacity * 2, 16))
+        row = self.size
+        self.round_number[row] = round_number
+        self.turn_number[row] = turn_number
+        self.player_number[row] = player_number
+        self.t_num[row] = t_num
+        self.set_dominos(self.play, row, play)
+        self.set_dominos(self.hand, row, hand)
+        self.set_dominos(self.unknown, row, unknown)
+        self.set_dominos(self.potential_plays, row, potential_plays)
+        for x in range(0, len(trains)):
+            self.set_dominos(self.trains[:, x], row, trains[x].train_list)
+            if trains[x].marker_up:
+                self.markers[row, x] = 1
+        self.size += 1
+
+    def end_round(self, round_number, hand_scores):
+        """
+        Sets the points column of the rows recorded during this round to the end of round
+        hand score of the row's player, leaving the rows of earlier rounds untouched
+        """
+        start = self.round_start
+        self.points[start:self.size] = np.asarray(hand_scores)[self.player_number[start:self.size]]
+        self.round_ranges.append((round_number, start, self.size))
+        self.round_start = self.size
+
+    def to_arrays(self):
+        """
+        Returns a dict of the recorded blocks trimmed to the number of rows recorded
+        """
+        arrays = {}
+        for name in ["round_number", "turn_number", "player_number", "t_num", "points",
+                     "markers", "play", "hand", "unknown", "potential_plays", "trains"]:
+            arrays[name] = getattr(self, name)[0:self.size]
+        return arrays
+
+    def to_dataframe(self, start_index=0):
+        """
+        Returns the recorded rows as a DataFrame in the column layout mexicantrain has always
+        returned, with the one hot blocks stored as lists and the index starting at start_index
+        """
+        rows = range(start_index, start_index + self.size)
+        data = pd.DataFrame(index=rows)
+        data["round_number"] = self.round_number[0:self.size]
+        data["turn_number"] = self.turn_number[0:self.size]
+        data["player_number"] = self.player_number[0:self.size]
+        data["play"] = self.play[0:self.size].tolist()
+        data["t_num"] = self.t_num[0:self.size]
+        data["hand"] = self.hand[0:self.size].tolist()
+        data["unknown"] = self.unknown[0:self.size].tolist()
+        data["potential_plays"] = self.potential_plays[0:self.size].tolist()
+        data["points"] = self.points[0:self.size]
+        for x in range(0, self.num_trains):
+            data["train_" + str(x)] = self.trains[0:self.size, x].tolist()
+            data["marker_" + str(x)] = self.markers[0:self.size, x]
+        return data
@@ -0,0 +1,246 @@
+import trainsolver
+import dominoclasses
+
+EMPTY = (-1, -1)
+
+class GameState:
+    """
+    The state of a round of mexican train in a form that is cheap to copy, for players that
+    look ahead by simulating the rest of the round.
+
+    Hands are bitmasks over the dominoclasses.DominoTable index, trains are kept as their last
+    domino (EMPTY before they start) and marker, and played is the bitmask of every domino on
+    a train. The deck is a tuple of the dominos still to be drawn in order with a cursor into
+    it, which clones share since drawing only moves the cursor. clone therefore copies a few
+    short lists, where copy.deepcopy of the game's Hand and Train objects copies every domino.
+
+    The round is played out with moves and step, following the rules mtrain.mexicantrain
+    plays by. A move is (t_num, dominos): the dominos placed, oriented as played, and the
+    train they go on. step(None) stands for having no play, which draws a domino the first
+    time in a turn and ends the turn with the player's marker up the second time.
+    double_up is the train with a double waiting to be covered, or -1, and own_double is set
+    while the player who placed it is trying to cover it themselves.
+    """
+
+    #How many search states the opening trains of simulated hands may expand (see trainsolver)
+    train_budget = 200
+
+    def __init__(self, round_number, domino_size, hands, ends, markers, played, deck, cursor=0,
+                 current_player=0, turn_number=1, double_up=-1, doom_counter=0):
+        self.round_number = round_number
+        self.domino_size = domino_size
+        self.table = dominoclasses.domino_table(domino_size)
+        self.num_players = len(hands)
+        self.hands = hands
+        self.ends = ends
+        self.markers = markers
+        self.played = played
+        self.deck = deck
+        self.cursor = cursor
+        self.current_player = current_player
+        self.turn_number = turn_number
+        self.double_up = double_up
+        self.own_double = False
+        self.drawn = False
+        self.doom_counter = doom_counter
+        self.over = False
+
+    @classmethod
+    def from_game(cls, round_number, domino_size, hands, trains, deck, current_player, turn_number,
+                  double_up, doom_counter):
+        """
+        Builds the state of a game in progress from mexicantrain's Hands, Trains and Deck,
+        with double_up as mexicantrain keeps it
+        """
+        table = dominoclasses.domino_table(domino_size)
+        played = 0
+        for train in trains:
+            played |= table.mask_of(train.train_list)
+        t_num = -1
+        if double_up[0]:
+            t_num = double_up[1]
+        return cls(round_number, domino_size, [table.mask_of(hand.dominos) for hand in hands],
+                   [train.get_last() for train in trains], [train.marker_up for train in trains],
+                   played, tuple(deck.dominos), 0, current_player, turn_number, t_num, doom_counter)
+
+    def clone(self):
+        state = GameState.__new__(GameState)
+        state.__dict__.update(self.__dict__)
+        state.hands = list(self.hands)
+        state.ends = list(self.ends)
+        state.markers = list(self.markers)
+        return state
+
+    def determinize(self, player_num, rng, hand=None):
+        """
+        Returns a clone with everything player_num can't see dealt out again at random: the
+        dominos not in their hand, on a train or the round's double are shuffled with rng and
+        handed back to the other players, each keeping the size of their hand, with the rest
+        making up the deck. hand replaces the player's hand if given, for a player that has
+        drawn since the state was made
+        """
+        state = self.clone()
+        table = self.table
+        if hand is not None:
+            state.hands[player_num] = table.mask_of(hand)
+        unknown = table.full_mask & ~state.hands[player_num] & ~self.played & ~table.double_masks[self.round_number]
+        dominos = table.dominos_in(unknown)
+        rng.shuffle(dominos)
+        start = 0
+        for other in range(0, self.num_players):
+            if other == player_num:
+                continue
+            size = bin(self.hands[other]).count("1")
+            state.hands[other] = table.mask_of(dominos[start:start + size])
+            start += size
+        state.deck = tuple(dominos[start:])
+        state.cursor = 0
+        return state
+
+    def hand(self, player_num):
+        return self.table.dominos_in(self.hands[player_num])
+
+    def scores(self):
+        return [self.table.score_of(mask) for mask in self.hands]
+
+    def target(self, t_num):
+        """
+        Returns the pip a domino needs to play on train t_num
+        """
+        if self.ends[t_num] == EMPTY:
+            return self.round_number
+        return self.ends[t_num][1]
+
+    def moves(self):
+        """
+        Returns the list of moves the current player has, following mexicantrain: covering the
+        waiting double, laying their opening train (found by trainsolver), or playing a single,
+        a double alone or a double with a followup on their own train or any with a marker up
+        """
+        table = self.table
+        player = self.current_player
+        hand = self.hands[player]
+        if self.double_up >= 0:
+            pip = self.ends[self.double_up][1]
+            return [(self.double_up, (oriented(domino, pip),)) for domino in table.dominos_in(hand & table.pip_masks[pip])
+                    if domino[0] != domino[1]]
+        if self.ends[player] == EMPTY:
+            train = trainsolver.longest_train(self.hand(player), self.round_number, self.train_budget)
+            if len(train) == 0:
+                return []
+            return [(player, tuple(train))]
+
+        moves = []
+        for t_num in range(0, self.num_players + 1):
+            if not (self.markers[t_num] or t_num == player):
+                continue
+            pip = self.target(t_num)
+            matches = table.dominos_in(hand & table.pip_masks[pip])
+            for domino in matches:
+                if domino[0] != domino[1]:
+                    moves.append((t_num, (oriented(domino, pip),)))
+                    continue
+                moves.append((t_num, (domino,)))
+                for followup in matches:
+                    if followup != domino:
+                        moves.append((t_num, (domino, oriented(followup, pip))))
+        return moves
+
+    def draw(self, player_num):
+        if self.cursor < len(self.deck):
+            self.hands[player_num] |= self.table.bit(self.deck[self.cursor])
+            self.cursor += 1
+
+    def step(self, move):
+        """
+        Plays move for the current player, moving on to the next player when their turn is over
+        """
+        player = self.current_player
+        if move is None:
+            if self.own_double:
+                self.markers[player] = True
+                self.own_double = False
+                self.end_turn()
+            elif not self.drawn:
+                self.draw(player)
+                self.drawn = True
+            else:
+                self.markers[player] = True
+                self.doom_counter += 1
+                self.end_turn()
+            return
+
+        t_num, dominos = move
+        opening = t_num == player and self.ends[t_num] == EMPTY
+        mask = self.table.mask_of(dominos)
+        self.hands[player] &= ~mask
+        self.played |= mask
+        self.ends[t_num] = dominos[-1]
+        self.doom_counter = 0
+        last = dominos[-1]
+        if self.double_up >= 0:
+            self.double_up = -1
+            self.own_double = False
+        elif opening:
+            #A train ending in a double earns a draw, but the double isn't covered
+            if last[0] == last[1]:
+                self.draw(player)
+        elif len(dominos) == 1 and last[0] == last[1]:
+            #The player draws and tries to cover their own double before their turn ends
+            self.draw(player)
+            self.drawn = True
+            self.double_up = t_num
+            self.own_double = True
+            return
+        self.end_turn()
+
+    def end_turn(self):
+        if self.hands[self.current_player] == 0 or self.doom_counter > self.num_players * 5:
+            self.over = True
+        self.current_player += 1
+        if self.current_player == self.num_players:
+            self.current_player = 0
+        self.turn_number += 1
+        self.drawn = False
+
+def oriented(domino, pip):
+    """
+    Returns domino turned so its first pip is pip
+    """
+    if domino[0] == pip:
+        return domino
+    return (domino[1], domino[0])
+
+def greedy_move(state, moves, rng):
+    """
+    Rollout policy picking the move that gets rid of the most pips, like GreedyPlayer
+    """
+    best = None
+    best_pips = -1
+    for move in moves:
+        pips = 0
+        for domino in move[1]:
+            pips += domino[0] + domino[1]
+        if pips > best_pips:
+            best = move
+            best_pips = pips
+    return best
+
+def random_move(state, moves, rng):
+    """
+    Rollout policy picking a move uniformly at random
+    """
+    return moves[rng.randrange(0, len(moves))]
+
+def rollout(state, policy=greedy_move, rng=None):
+    """
+    Plays state out to the end of the round, every player choosing its moves with policy
+    Returns the end of round hand scores
+    """
+    while not state.over:
+        moves = state.moves()
+        if len(moves) == 0:
+            state.step(None)
+        else:
+            state.step(policy(state, moves, rng))
+    return state.scores()
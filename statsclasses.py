@@ -0,0 +1,121 @@
+import time
+
+#The phase each timed method counts towards
+player_phases = {"play_train": "decisions", "play_normally": "decisions",
+                 "play_forced_double": "decisions", "start_round": "knowledge",
+                 "drew": "knowledge", "saw_play": "knowledge"}
+deck_phases = {"draw": "deck"}
+recorder_phases = {"end_round": "backfill", "to_arrays": "recording", "to_dataframe": "recording"}
+
+class TimedProxy:
+    """
+    Stands in for a player, deck or recorder, passing every attribute through to it, but
+    timing each call of the methods in phases and adding it to a GameStats under the
+    method's phase and under label + "." + the method name
+    """
+
+    def __init__(self, target, stats, phases, label):
+        self.target = target
+        self.stats = stats
+        self.phases = phases
+        self.label = label
+
+    def __getattr__(self, name):
+        attribute = getattr(self.target, name)
+        phase = self.phases.get(name)
+        if phase is None:
+            return attribute
+        return self.stats.timed_function(attribute, phase, self.label + "." + name)
+
+class GameStats:
+    """
+    Collects timings and counters from mtrain.mexicantrain when passed in as its stats.
+
+    seconds holds the cumulative wall time of each phase of the game:
+    - decisions: the players' play_train, play_normally and play_forced_double
+    - knowledge: the players' start_round, drew and saw_play updates
+    - deck: shuffling decks and drawing from them
+    - recording: recording rows in data_collection mode and building the data at the end
+    - backfill: filling in the points of a round's rows once it ends
+    - total: the whole game, so what isn't in any other phase is total less their sum
+
+    calls and call_seconds count the calls and time of every timed method, keyed on
+    "mode.method" for players (like "Greedy.play_normally"), "Deck.draw" and "RowRecorder.*".
+    counters holds games, rounds, draws (dominos drawn during turns, not counting turns that
+    found the deck empty), forced_double_episodes (doubles left uncovered for the next
+    player) and doom_terminations (rounds ended by the doom counter), and turns_per_round
+    the number of turns each round took.
+
+    Stats from different games or processes are combined with merge, and summary returns
+    everything as a plain dict.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self.call_seconds = {}
+        self.counters = {}
+        self.turns_per_round = []
+
+    def add_time(self, phase, seconds):
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+
+    def count(self, name, number=1):
+        self.counters[name] = self.counters.get(name, 0) + number
+
+    def timed(self, target, phases, label):
+        """
+        Returns a TimedProxy standing in for target
+        """
+        return TimedProxy(target, self, phases, label)
+
+    def timed_function(self, function, phase, label):
+        """
+        Returns function wrapped to add the time of each call to phase and to label
+        """
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            seconds = time.perf_counter() - start
+            self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+            self.calls[label] = self.calls.get(label, 0) + 1
+            self.call_seconds[label] = self.call_seconds.get(label, 0.0) + seconds
+            return result
+        return timed
+
+    def end_round(self, turns, doomed):
+        self.count("rounds")
+        self.turns_per_round.append(turns)
+        if doomed:
+            self.count("doom_terminations")
+
+    def merge(self, other):
+        """
+        Adds the stats collected in other to these
+        """
+        for phase, seconds in other.seconds.items():
+            self.add_time(phase, seconds)
+        for label, calls in other.calls.items():
+            self.calls[label] = self.calls.get(label, 0) + calls
+        for label, seconds in other.call_seconds.items():
+            self.call_seconds[label] = self.call_seconds.get(label, 0.0) + seconds
+        for name, number in other.counters.items():
+            self.count(name, number)
+        self.turns_per_round += other.turns_per_round
+
+    def summary(self):
+        """
+        Returns the stats as a dict, with the time outside every phase as seconds["other"]
+        and the mean turns per round
+        """
+        seconds = dict(self.seconds)
+        phases = [phase for phase in seconds if phase != "total"]
+        seconds["other"] = seconds.get("total", 0.0) - sum(seconds[phase] for phase in phases)
+        counters = {"games": 0, "rounds": 0, "draws": 0, "forced_double_episodes": 0, "doom_terminations": 0}
+        counters.update(self.counters)
+        mean_turns = 0.0
+        if len(self.turns_per_round) > 0:
+            mean_turns = sum(self.turns_per_round) / float(len(self.turns_per_round))
+        return {"seconds": seconds, "calls": dict(self.calls), "call_seconds": dict(self.call_seconds),
+                "counters": counters, "mean_turns_per_round": mean_turns,
+                "turns_per_round": list(self.turns_per_round)}
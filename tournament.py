@@ -0,0 +1,237 @@
+import math
+import random
+import itertools
+import multiprocessing
+from scipy.stats import norm
+import mtrainsimulator
+
+class RunningStats:
+    """
+    The running mean and variance of a stream of values, kept with Welford's method so they
+    can be read at any time without holding on to every value
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+    def std_error(self):
+        if self.count < 2:
+            return float("inf")
+        return math.sqrt(self.variance() / self.count)
+
+    def interval(self, z):
+        """
+        Returns the confidence interval of the mean for the normal quantile z
+        """
+        half = z * self.std_error()
+        return [self.mean - half, self.mean + half]
+
+class Tournament:
+    """
+    The running results of a tournament between player modes.
+
+    For every mode it keeps the running mean and variance of the end of game score and the
+    win rate of the seats that mode played. For every pair of modes it also keeps the
+    running difference of their mean scores on each deal they both played, which varies far
+    less than either score since both sides had the same luck of the shuffle. A deal is a
+    single game, or in a duplicate tournament the games played on the same deals with the
+    seats rotated, where the modes are compared on exactly the same hands.
+
+    The ranking orders the modes by mean score, lowest (best) first. It is settled once
+    every pair of modes next to each other in it is told apart: the confidence interval of
+    their score difference leaves out 0, or is narrower than tolerance points either way, in
+    which case the two play about as well as each other and more games won't change that.
+    """
+
+    def __init__(self, modes):
+        self.modes = sorted(set(modes))
+        self.games = 0
+        self.deals = 0
+        self.scores = {}
+        self.wins = {}
+        for mode in self.modes:
+            self.scores[mode] = RunningStats()
+            self.wins[mode] = RunningStats()
+        self.differences = {}
+        for pair in itertools.combinations(self.modes, 2):
+            self.differences[pair] = RunningStats()
+
+    def add_game(self, seat_modes, scores, winner):
+        """
+        Adds the results of a game, where seat_modes is the mode playing each seat
+        """
+        self.add_deal([(seat_modes, scores, winner)])
+
+    def add_deal(self, games):
+        """
+        Adds the results of the games played on one deal, each a tuple of (seat_modes, scores, winner)
+        """
+        deal_scores = {}
+        for seat_modes, scores, winner in games:
+            self.games += 1
+            for seat in range(0, len(seat_modes)):
+                mode = seat_modes[seat]
+                self.scores[mode].add(scores[seat])
+                self.wins[mode].add(1.0 if winner == seat else 0.0)
+                deal_scores.setdefault(mode, []).append(scores[seat])
+        self.deals += 1
+        for pair, difference in self.differences.items():
+            if pair[0] in deal_scores and pair[1] in deal_scores:
+                difference.add(sum(deal_scores[pair[0]]) / float(len(deal_scores[pair[0]])) -
+                               sum(deal_scores[pair[1]]) / float(len(deal_scores[pair[1]])))
+
+    def difference(self, first, second, z):
+        """
+        Returns the mean score of first less that of second, its standard error and its
+        confidence interval
+        """
+        if (first, second) in self.differences:
+            difference = self.differences[(first, second)]
+            return difference.mean, difference.std_error(), difference.interval(z)
+        difference = self.differences[(second, first)]
+        low, high = difference.interval(z)
+        return -difference.mean, difference.std_error(), [-high, -low]
+
+    def ranking(self):
+        return sorted(self.modes, key=lambda mode: self.scores[mode].mean)
+
+    def settled(self, z, tolerance):
+        ranking = self.ranking()
+        for place in range(0, len(ranking) - 1):
+            mean, std_error, interval = self.difference(ranking[place], ranking[place + 1], z)
+            if interval[0] <= 0 <= interval[1] and interval[1] - interval[0] >= 2 * tolerance:
+                return False
+        return True
+
+    def summary(self, z, tolerance):
+        """
+        Returns the results as a dict, with the score difference of every pair of modes, the
+        better ranked first
+        """
+        modes = {}
+        for mode in self.modes:
+            modes[mode] = {"seats": self.scores[mode].count,
+                           "mean_score": self.scores[mode].mean,
+                           "score_interval": self.scores[mode].interval(z),
+                           "win_rate": self.wins[mode].mean,
+                           "win_interval": self.wins[mode].interval(z)}
+        differences = {}
+        ranking = self.ranking()
+        for first, second in itertools.combinations(ranking, 2):
+            mean, std_error, interval = self.difference(first, second, z)
+            differences[first + " - " + second] = {"mean": mean, "std_error": std_error, "interval": interval}
+        return {"games": self.games, "deals": self.deals, "ranking": ranking,
+                "settled": self.settled(z, tolerance),
+                "modes": modes, "differences": differences}
+
+def print_summary(summary):
+    print("After " + str(summary["games"]) + " games" + ("" if summary["settled"] else ", not settled") + ":")
+    for mode in summary["ranking"]:
+        results = summary["modes"][mode]
+        print(mode + ": mean score " + str(round(results["mean_score"], 1)) + " " +
+              str([round(bound, 1) for bound in results["score_interval"]]) + ", win rate " +
+              str(round(results["win_rate"], 3)) + " " + str([round(bound, 3) for bound in results["win_interval"]]))
+    for pair, results in summary["differences"].items():
+        print(pair + ": " + str(round(results["mean"], 1)) + " +/- " + str(round(results["std_error"], 2)) + " " +
+              str([round(bound, 1) for bound in results["interval"]]))
+
+def run_tournament(modes=["Greedy", "Probability", "Neural"], num_players=None, domino_size=12,
+                   file_name="PlayData/data3_12_250", workers=1, chunksize=1, seed=None,
+                   confidence=.95, tolerance=5.0, min_games=None, max_games=5000, duplicate=False, debug=True):
+    """
+    Plays the player modes against each other until their ranking is settled (see Tournament).
+
+    Every seating of num_players of the modes (all of them by default) is played in turn, so
+    each mode plays every seat equally often. With more players than modes, the seatings are
+    every way to fill the seats in which each mode sits at least once. The seatings are played in blocks of one game
+    each (more if there are more workers than seatings), spread across a process pool when
+    workers is more than 1, and the ranking is checked after every block. The tournament
+    stops once the ranking is settled at the given confidence and after at least min_games
+    (5 blocks by default), or at max_games. Checking after every block makes the intervals
+    a little optimistic, so a higher confidence makes for a safer answer.
+
+    With duplicate on, the tournament is played like duplicate bridge: every block deals
+    seeded hands (see the deal_seed of mtrain.mexicantrain) and replays them once for each
+    rotation of modes through the seats, so every mode plays every hand. The score
+    differences are then paired on the same hands, which takes out most of the luck of the
+    shuffle, and the ranking settles in far fewer games. Every mode sits at the table in
+    duplicate mode, so num_players must be len(modes).
+
+    Every game is seeded from a random.Random(seed) stream, so a seeded tournament plays the
+    same games every time. file_name is the data file the Neural players load their model for.
+    Returns the summary of the Tournament
+    """
+    if num_players is None:
+        num_players = len(modes)
+    if num_players <= len(modes):
+        seatings = sorted(set(itertools.permutations(modes, num_players)))
+    else:
+        seatings = sorted(seating for seating in set(itertools.product(modes, repeat=num_players))
+                          if set(seating) == set(modes))
+    if duplicate:
+        if num_players != len(modes):
+            raise ValueError("num_players must equal len(modes) in duplicate mode")
+        seatings = [tuple(modes[seat:]) + tuple(modes[:seat]) for seat in range(0, num_players)]
+    repeats = max(1, workers // len(seatings))
+    if min_games is None:
+        min_games = 5 * repeats * len(seatings)
+    z = float(norm.ppf(.5 + confidence / 2))
+
+    rng = random.Random(seed)
+    tournament = Tournament(modes)
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+    try:
+        while tournament.games < max_games:
+            games = []
+            for repeat in range(0, repeats):
+                deal_seed = None
+                if duplicate:
+                    deal_seed = rng.randrange(2**32)
+                for seating in seatings:
+                    games.append((rng.randrange(2**32), num_players, domino_size, list(seating), False, False,
+                                  file_name, "dataframe", False, False, deal_seed))
+            if pool is not None:
+                all_results = pool.imap(mtrainsimulator.play_game, games, chunksize)
+            else:
+                all_results = map(mtrainsimulator.play_game, games)
+            deal = []
+            for game, results in zip(games, all_results):
+                if not duplicate:
+                    tournament.add_game(game[3], results[0], results[1])
+                    continue
+                deal.append((game[3], results[0], results[1]))
+                if len(deal) == len(seatings):
+                    tournament.add_deal(deal)
+                    deal = []
+
+            if tournament.games >= min_games and tournament.settled(z, tolerance):
+                break
+            if debug: print("Played " + str(tournament.games) + " games, ranking " + str(tournament.ranking()))
+    except BaseException:
+        #Stop the workers straight away instead of waiting for the rest of the block
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    summary = tournament.summary(z, tolerance)
+    if debug: print_summary(summary)
+    return summary
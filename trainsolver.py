@@ -0,0 +1,154 @@
+import random
+import time
+import collections
+import dominoclasses
+
+class TrainSolver:
+    """
+    Finds the opening train a player should lay from a hand.
+
+    The hand is treated as a multigraph whose vertices are pip values and whose edges are
+    dominos (a double is a loop on its pip). A train is a trail through this graph starting
+    at the round's pip, using every domino at most once. The best train is the one with the
+    most dominos, with ties going to the train with the most pips, and then to the train
+    found first when the hand is searched in order.
+
+    The search is a depth first search memoized on (current pip, remaining hand bitmask), so
+    each reachable state of the hand is solved once. node_budget caps how many states are
+    expanded; once it runs out the search stops extending trains and returns the best train
+    found within the budget.
+    """
+
+    def __init__(self, dominos, node_budget=2000):
+        self.dominos = list(dominos)
+        self.node_budget = node_budget
+        self.nodes = 0
+        self.memo = {}
+        #For every pip, the dominos touching it as (bit, pip on the other end, pip total)
+        self.edges = {}
+        for location in range(0, len(self.dominos)):
+            domino = self.dominos[location]
+            self.edges.setdefault(domino[0], []).append((1 << location, domino[1], domino[0] + domino[1]))
+            if domino[0] != domino[1]:
+                self.edges.setdefault(domino[1], []).append((1 << location, domino[0], domino[0] + domino[1]))
+
+    def best_from(self, pip, remaining):
+        """
+        Returns (dominos, pips, bit, next pip) of the best train continuing from pip using
+        only the dominos in remaining, where bit and next pip describe its first domino
+        """
+        key = (pip, remaining)
+        best = self.memo.get(key)
+        if best is not None:
+            return best
+        best = (0, 0, 0, -1)
+        if self.nodes < self.node_budget:
+            self.nodes += 1
+            for bit, other, pips in self.edges.get(pip, []):
+                if not remaining & bit:
+                    continue
+                follow = self.best_from(other, remaining ^ bit)
+                count = follow[0] + 1
+                total = follow[1] + pips
+                if count > best[0] or (count == best[0] and total > best[1]):
+                    best = (count, total, bit, other)
+        self.memo[key] = best
+        return best
+
+    def solve(self, start_value):
+        """
+        Returns the best train from start_value as a list of (a, b) dominos, each oriented so
+        that a matches the end of the train before it
+        """
+        train = []
+        pip = start_value
+        remaining = (1 << len(self.dominos)) - 1
+        best = self.best_from(pip, remaining)
+        while best[0] > 0:
+            train.append((pip, best[3]))
+            remaining ^= best[2]
+            pip = best[3]
+            best = self.best_from(pip, remaining)
+        return train
+
+def longest_train(dominos, start_value, node_budget=2000):
+    """
+    Returns the longest train that can be played from start_value with the given dominos
+    See TrainSolver for how the train is chosen
+    """
+    return TrainSolver(dominos, node_budget).solve(start_value)
+
+class TrainCache:
+    """
+    A bounded LRU cache of opening trains, keyed on the hand and the start value.
+
+    The hand is put in a canonical form first (each domino as (low, high), sorted), and the
+    train is solved on that canonical hand, so the same set of dominos always gives the same
+    train no matter what order or orientation it is held in. Once maxsize entries are stored
+    the least recently used one is dropped. hits and misses count how often a train came from
+    the cache or had to be solved.
+    """
+
+    def __init__(self, maxsize=100000, node_budget=2000):
+        self.maxsize = maxsize
+        self.node_budget = node_budget
+        self.trains = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def longest_train(self, dominos, start_value):
+        hand = tuple(sorted((min(domino), max(domino)) for domino in dominos if domino[0] >= 0))
+        key = (hand, start_value)
+        train = self.trains.get(key)
+        if train is not None:
+            self.hits += 1
+            self.trains.move_to_end(key)
+            return list(train)
+        self.misses += 1
+        train = tuple(longest_train(hand, start_value, self.node_budget))
+        self.trains[key] = train
+        if len(self.trains) > self.maxsize:
+            self.trains.popitem(last=False)
+        return list(train)
+
+    def clear(self):
+        self.trains = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.trains)}
+
+#The cache shared by every player in the process
+train_cache = TrainCache()
+
+def benchmark(num_hands=200, hand_size=12, domino_size=12, seed=0):
+    """
+    Times longest_train against the tree search it replaced (Player.build_network and
+    Player.find_longest_path) on the same random hands.
+    Returns a dict with the total seconds each took and the average train length each found
+    """
+    import playerclasses
+    rng = random.Random(seed)
+    full_set = dominoclasses.domino_table(domino_size).dominos
+    hands = []
+    for hand_num in range(0, num_hands):
+        hands.append((rng.sample(full_set, hand_size), rng.randrange(0, domino_size + 1)))
+
+    player = playerclasses.GreedyPlayer(0)
+    start = time.perf_counter()
+    tree_lengths = []
+    for dominos, start_value in hands:
+        path = player.find_longest_path(player.build_network(dominos, start_value, []), [])
+        tree_lengths.append(len(path) - 1)
+    tree_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    solver_lengths = []
+    for dominos, start_value in hands:
+        solver_lengths.append(len(longest_train(dominos, start_value)))
+    solver_time = time.perf_counter() - start
+
+    return {"tree_seconds": tree_time, "solver_seconds": solver_time,
+            "tree_average_length": sum(tree_lengths) / float(num_hands),
+            "solver_average_length": sum(solver_lengths) / float(num_hands)}